@@ -1,5 +1,6 @@
 from __future__ import with_statement
 import py
+from array import array
 
 try:
     set
@@ -358,6 +359,9 @@ return ~i""")
         exec py.code.Source(result).compile()
         return recognize
 
+    def make_lexing_table(self):
+        return LexingTable(self)
+
     def get_runner(self):
         return DFARunner(self)
 
@@ -407,6 +411,98 @@ return ~i""")
             py.process.cmdexec("fdp -Tplain %s > %s" % (p, plainpath))
         graphclient.display_dot_file(str(plainpath))
 
+class LexingTable(object):
+    """Dense transition table of a lexing DFA. Characters that have the same
+    transitions in every state are mapped to the same character class, so
+    each state needs a single row with one entry per class. `recognize` can
+    be used instead of the code generated by `DFA.make_lexing_code`."""
+
+    NONE = 0xffff
+
+    def __init__(self, automaton):
+        assert automaton.num_states < self.NONE
+        columns = {}
+        for (state, char), nextstate in automaton.transitions.iteritems():
+            columns.setdefault(char, {})[state] = nextstate
+        # class 0 contains all characters without any transitions
+        class_ids = {(): 0}
+        self.classes = array('H', [0] * 256)
+        for char, column in columns.iteritems():
+            key = tuple(sorted(column.iteritems()))
+            self.classes[ord(char)] = class_ids.setdefault(key, len(class_ids))
+        self.width = len(class_ids)
+        self.transitions = array('H', [self.NONE] * (automaton.num_states * self.width))
+        for key, class_id in class_ids.iteritems():
+            for state, nextstate in key:
+                self.transitions[state * self.width + class_id] = nextstate
+        self.final = array('B', [0] * automaton.num_states)
+        for state in automaton.final_states:
+            self.final[state] = 1
+        # states that can still read characters, i.e. a token ending in one
+        # of them looks ahead at least one character
+        self.lookahead = array('B', [0] * automaton.num_states)
+        for state, _ in automaton.transitions:
+            self.lookahead[state] = 1
+        # combination of both for the matcher: 0 = not final, 1 = final,
+        # 2 = final without transitions
+        self.kinds = array('B', [0] * automaton.num_states)
+        for state in range(automaton.num_states):
+            assert self.lookahead[state] or self.final[state]
+            if not self.lookahead[state]:
+                self.kinds[state] = 2
+            elif self.final[state]:
+                self.kinds[state] = 1
+        self.recognize = self.make_recognize()
+
+    def make_recognize(self):
+        classes = self.classes
+        transitions = self.transitions
+        width = self.width
+        kinds = self.kinds
+        NONE = self.NONE
+
+        def recognize(runner, i):
+            assert i >= 0
+            input = runner.text
+            state = 0
+            matched = False
+            while 1:
+                kind = kinds[state]
+                if kind:
+                    matched = True
+                    last_index = i - 1
+                    last_state = state
+                    if kind == 2:
+                        if i == len(input):
+                            result = i
+                        else:
+                            result = ~i
+                        break
+                try:
+                    char = input[i]
+                except IndexError:
+                    if kind:
+                        result = i
+                    else:
+                        result = ~i
+                    break
+                i += 1
+                code = ord(char)
+                if code < 256:
+                    nextstate = transitions[state * width + classes[code]]
+                else:
+                    nextstate = NONE
+                if nextstate == NONE:
+                    result = ~i
+                    break
+                state = nextstate
+            runner.state = state
+            if matched:
+                runner.last_matched_index = last_index
+                runner.last_matched_state = last_state
+            return result
+        return recognize
+
 class DFARunner(object):
     def __init__(self, automaton):
         self.automaton = automaton
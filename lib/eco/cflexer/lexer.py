@@ -71,7 +71,7 @@ except:
     import pickle
 
 class Lexer(object):
-    def __init__(self, token_regexs, names, ignore=None):
+    def __init__(self, token_regexs, names, ignore=None, table=True):
         self.token_regexs = token_regexs
         self.names = names
         self.rex = regex.LexingOrExpression(token_regexs, names)
@@ -91,12 +91,24 @@ class Lexer(object):
         for ign in ignore:
             assert ign in names
         self.ignore = dict.fromkeys(ignore)
-        self.matcher = self.automaton.make_lexing_code()
+        # the table driven matcher avoids generating and compiling the
+        # matching code, and is faster on long inputs
+        if table:
+            self.table = self.automaton.make_lexing_table()
+            self.matcher = self.table.recognize
+        else:
+            self.table = None
+            self.matcher = self.automaton.make_lexing_code()
 
     def get_runner(self, text, eof=False):
         return LexingDFARunner(self.matcher, self.automaton, text,
-                               self.ignore, eof)
+                               self.ignore, eof, self.table)
 
+    def tokenize_pairs(self, text):
+        """Return an iterator of (source, name) pairs from text. Cheaper than
+        tokenize, as no Token or SourcePos objects are created."""
+        return PairLexingDFARunner(self.matcher, self.automaton, text,
+                                   self.ignore, False, self.table)
     def tokenize(self, text, eof=False):
         """Return a list of Token's from text."""
         r = self.get_runner(text, eof)
@@ -116,7 +128,7 @@ class Lexer(object):
                 self.ignore)
 
     def __getstate__(self):
-        return (self.token_regexs, self.names, self.ignore)
+        return (self.token_regexs, self.names, self.ignore, self.table is not None)
 
     def __setstate__(self, args):
         self.__init__(*args)
@@ -133,11 +145,13 @@ class DummyLexer(Lexer):
         self.automaton = automaton
         self.ignore = ignore
         self.matcher = matcher
+        self.table = None
 
 class AbstractLexingDFARunner(deterministic.DFARunner):
     i = 0
-    def __init__(self, matcher, automaton, text, eof=False):
+    def __init__(self, matcher, automaton, text, eof=False, table=None):
         self.automaton = automaton
+        self.table = table
         self.state = 0
         self.text = text
         self.last_matched_state = 0
@@ -184,10 +198,13 @@ class AbstractLexingDFARunner(deterministic.DFARunner):
             if self.last_matched_index == i - 1:
                 # no progress (loop)
                 lookahead = 0
-                for from_, to in self.automaton.transitions.iterkeys():
-                    if from_ == self.state:
-                        lookahead = 1
-                        break
+                if self.table is not None:
+                    lookahead = self.table.lookahead[self.state]
+                else:
+                    for from_, to in self.automaton.transitions.iterkeys():
+                        if from_ == self.state:
+                            lookahead = 1
+                            break
                 source = self.text[start: ]
                 result = self.make_token(start, self.last_matched_state, source, lookahead = lookahead)
                 self.last_matched_index = start + len(source)
@@ -237,8 +254,8 @@ class AbstractLexingDFARunner(deterministic.DFARunner):
         return self
 
 class LexingDFARunner(AbstractLexingDFARunner):
-    def __init__(self, matcher, automaton, text, ignore, eof=False):
-        AbstractLexingDFARunner.__init__(self, matcher, automaton, text, eof)
+    def __init__(self, matcher, automaton, text, ignore, eof=False, table=None):
+        AbstractLexingDFARunner.__init__(self, matcher, automaton, text, eof, table)
         self.ignore = ignore
 
     def ignore_token(self, state):
@@ -251,3 +268,12 @@ class LexingDFARunner(AbstractLexingDFARunner):
             return Token("EOF", "EOF", source_pos, lookahead)
         return Token(self.automaton.names[self.last_matched_state],
                      text, source_pos, lookahead)
+
+class PairLexingDFARunner(LexingDFARunner):
+    def make_token(self, index, state, text, eof=False, lookahead=None):
+        if eof:
+            return ("EOF", "EOF")
+        return (text, self.automaton.names[self.last_matched_state])
+
+    def adjust_position(self, token):
+        pass
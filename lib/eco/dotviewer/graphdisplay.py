@@ -495,11 +495,11 @@ class GraphDisplay(Display):
         version = self.layout.pgviewer.version
         s = [attr.upper(), ": "]
         try:
-            r = node.log[(attr, version)]
+            r = node.get_attr(attr, version)
             if r is None:
                 return
             s.append(self.format_info(r))
-        except KeyError:
+        except AttributeError:
             try:
                 s.append(self.format_info(node.__getattribute__(attr)))
                 s.append("(current)")
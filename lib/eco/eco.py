@@ -484,10 +484,23 @@ class FindDialog(QtGui.QDialog):
         self.ui.setupUi(self)
         self.ui.buttonBox.button(QDialogButtonBox.Ok).setText("Find")
         self.ui.buttonBox.button(QDialogButtonBox.Ok).setIcon(QIcon.fromTheme("find"))
+        button = self.ui.buttonBox.addButton("Replace all", QDialogButtonBox.ActionRole)
+        self.connect(button, SIGNAL("clicked()"), self.replace_all)
+        self.replace = False
+
+    def replace_all(self):
+        self.replace = True
+        self.accept()
 
     def getText(self):
         return self.ui.leText.text()
 
+    def getReplacement(self):
+        return self.ui.leReplace.text()
+
+    def isRegex(self):
+        return self.ui.cbRegex.isChecked()
+
     def focus(self):
         self.ui.leText.setFocus(True)
         self.ui.leText.selectAll()
@@ -986,18 +999,25 @@ class Window(QtGui.QMainWindow):
 
     def find(self):
         self.finddialog.focus()
+        self.finddialog.replace = False
         result = self.finddialog.exec_()
         if result:
-            text = self.finddialog.getText()
-            self.getEditor().tm.find_text(text)
+            text = str(self.finddialog.getText())
+            regex = self.finddialog.isRegex()
+            if self.finddialog.replace:
+                replacement = str(self.finddialog.getReplacement())
+                self.getEditor().tm.replace_all(text, replacement, regex)
+                self.getEditor().tm.undo_snapshot()
+            else:
+                self.getEditor().tm.find_text(text, regex)
             self.getEditor().update()
             self.btReparse([])
             self.getEditorTab().keypress()
 
     def find_next(self):
-        text = self.finddialog.getText()
+        text = str(self.finddialog.getText())
         if text:
-            self.getEditor().tm.find_text(text)
+            self.getEditor().tm.find_text(text, self.finddialog.isRegex())
             self.getEditor().update()
             self.btReparse([])
             self.getEditorTab().keypress(center=True)
@@ -104,7 +104,7 @@ class EditorTab(QWidget):
             lexer = IncrementalLexer(str(lang.priorities))
             self.editor.set_mainlanguage(lrp, lexer, lang.name)
         elif isinstance(lang, EcoGrammar):
-            bootstrap = BootstrapParser(lr_type=1, whitespaces=whitespace)
+            bootstrap = BootstrapParser(lr_type=lang.lr_type, whitespaces=whitespace)
             bootstrap.parse(lang.grammar)
             self.editor.set_mainlanguage(bootstrap.incparser, bootstrap.inclexer, lang.name)
         elif isinstance(lang, EcoFile):
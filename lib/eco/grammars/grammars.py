@@ -19,6 +19,10 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import hashlib
+
+from incparser.constants import LR1
+
 class Language(object):
 
     def __init__(self, name, grammar, priorities, base=""):
@@ -32,20 +36,22 @@ class Language(object):
 
 class EcoGrammar(object):
 
-    def __init__(self, name, grammar, base=""):
+    def __init__(self, name, grammar, base="", lr_type=LR1):
         self.name = name
         self.grammar = grammar
         self.base = base
+        self.lr_type = lr_type
 
     def __str__(self):
         return self.name
 
 _cache = {}
 class EcoFile(object):
-    def __init__(self, name, filename, base=""):
+    def __init__(self, name, filename, base="", lr_type=LR1):
         self.name = name
         self.filename = filename
         self.base = base
+        self.lr_type = lr_type # or LALR (see incparser.constants)
         self.alts = {}
         self.extract = None
 
@@ -53,9 +59,10 @@ class EcoFile(object):
         from grammar_parser.bootstrap import BootstrapParser
         from jsonmanager import JsonManager
 
-        if _cache.has_key(self.name + "::parser"):
+        key = "%s::%s" % (self.name, self.lr_type)
+        if _cache.has_key(key + "::parser"):
 
-            root, language, whitespaces = _cache[self.name + "::json"]
+            root, language, whitespaces = _cache[key + "::json"]
 
             # parse rules as they are needed by the incremental parser to
             # detect comments
@@ -63,18 +70,18 @@ class EcoFile(object):
             manager = JsonManager(unescape=True)
             root, language, whitespaces = manager.load(self.filename)[0]
 
-            pickle_id = hash(self)
-            bootstrap = BootstrapParser(lr_type=1, whitespaces=whitespaces)
+            pickle_id = self.digest()
+            bootstrap = BootstrapParser(lr_type=self.lr_type, whitespaces=whitespaces)
             bootstrap.ast = root
             bootstrap.parse_rules(root.children[1].children[1].children[0])
 
-            pickle_id, whitespace = _cache[self.name + "::parser"]
+            pickle_id, whitespace, lr_type, precedences = _cache[key + "::parser"]
             from incparser.incparser import IncParser
             incparser = IncParser()
-            incparser.from_dict(bootstrap.rules, None, None, whitespace, pickle_id, None)
+            incparser.from_dict(bootstrap.rules, None, lr_type, whitespace, pickle_id, precedences)
             incparser.init_ast()
 
-            inclexer = _cache[self.name + "::lexer"]
+            inclexer = _cache[key + "::lexer"]
             incparser.lexer = inclexer # give parser a reference to its lexer (needed for multiline comments)
 
             return (incparser, inclexer)
@@ -82,8 +89,8 @@ class EcoFile(object):
             manager = JsonManager(unescape=True)
             root, language, whitespaces = manager.load(self.filename)[0]
 
-            pickle_id = hash(self)
-            bootstrap = BootstrapParser(lr_type=1, whitespaces=whitespaces)
+            pickle_id = self.digest()
+            bootstrap = BootstrapParser(lr_type=self.lr_type, whitespaces=whitespaces)
             bootstrap.ast = root
             bootstrap.extra_alternatives = self.alts
             bootstrap.change_startrule = self.extract
@@ -94,9 +101,9 @@ class EcoFile(object):
             bootstrap.create_lexer()
             whitespace = bootstrap.implicit_ws()
 
-            _cache[self.name + "::lexer"] = bootstrap.inclexer
-            _cache[self.name + "::json"] = (root, language, whitespaces)
-            _cache[self.name + "::parser"] = (pickle_id, whitespace)
+            _cache[key + "::lexer"] = bootstrap.inclexer
+            _cache[key + "::json"] = (root, language, whitespaces)
+            _cache[key + "::parser"] = (pickle_id, whitespace, bootstrap.lr_type, bootstrap.precedences)
 
             bootstrap.incparser.lexer = bootstrap.inclexer
             return (bootstrap.incparser, bootstrap.inclexer)
@@ -112,6 +119,14 @@ class EcoFile(object):
     def __str__(self):
         return self.name
 
+    def digest(self):
+        """Stable digest of this grammar, used as key for the table cache."""
+        h = hashlib.sha1()
+        h.update(file(self.filename, "r").read())
+        h.update(repr(sorted(self.alts.items())))
+        h.update(str(self.extract))
+        return h.hexdigest()
+
     def __hash__(self):
         h1 = hash(file(self.filename, "r").read())
         h2 = hash(repr(self.alts))
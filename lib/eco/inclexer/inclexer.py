@@ -23,7 +23,8 @@ from grammar_parser.plexer import PriorityLexer
 from grammar_parser.gparser import MagicTerminal, Terminal, IndentationTerminal
 from incparser.astree import BOS, EOS, TextNode, ImageNode
 from PyQt4.QtGui import QImage
-import re, os
+import re, os, sys
+from bisect import bisect_right
 
 class IncrementalLexer(object):
     # XXX needs to be replaced by a lexing automaton to avoid unnecessary
@@ -41,6 +42,7 @@ class IncrementalLexer(object):
         self.compiled_regexes = {}
         for regex in self.regexlist:
             self.compiled_regexes[regex] = re.compile(regex)
+        self.combine_regexes()
 
     def is_indentation_based(self):
         return self.indentation_based
@@ -52,6 +54,50 @@ class IncrementalLexer(object):
             if name == "indentation" and value == "true":
                 self.indentation_based = True
 
+    def combine_regexes(self):
+        """
+        Combine the rules into as few regular expressions as possible, so that
+        all rules can be matched at a position with a few calls. Every rule is
+        wrapped into an optional lookahead whose group records the end of the
+        rule's match. Python limits the number of groups per expression, and
+        rules with backreferences, named groups or flags can't be combined.
+
+        Sets self.combined_regexes to a list of (regex, [(group, name)]), which
+        contains all rules sorted by priority.
+        """
+        self.combined_regexes = []
+        chunk = []
+        groups = 0
+        rules = sorted(self.regexlist.items(), key=lambda rule: rule[1][0])
+        for regex, (_, name) in rules:
+            compiled = self.compiled_regexes[regex]
+            if re.search(r"\\[1-9]|\(\?P|\(\?[iLmsux]", regex):
+                self.add_combined_regex(chunk)
+                chunk = []
+                groups = 0
+                self.combined_regexes.append((compiled, [(0, name)]))
+                continue
+            if groups + compiled.groups + 1 >= 100:
+                self.add_combined_regex(chunk)
+                chunk = []
+                groups = 0
+            chunk.append((regex, name))
+            groups += compiled.groups + 1
+
+        self.add_combined_regex(chunk)
+
+    def add_combined_regex(self, rules):
+        if not rules:
+            return
+        pattern = []
+        for i, (regex, _) in enumerate(rules):
+            pattern.append("(?:(?=(?P<rule%s>%s)))?" % (i, regex))
+        combined = re.compile("".join(pattern))
+        groups = []
+        for i, (_, name) in enumerate(rules):
+            groups.append((combined.groupindex["rule%s" % i], name))
+        self.combined_regexes.append((combined, groups))
+
     def lex(self, text):
         """
         Applies lexing to the given piece of text.
@@ -61,36 +107,29 @@ class IncrementalLexer(object):
         :return: an array of (value, name, priority) =  (regex_result, regex_name, regex_priority)
         """
         matches = []
-        remaining = text
+        pos = 0
+        end = len(text)
         any_match_found = False
-        while remaining != "":
-            longest_match = ("", "", 999999)
-            for regex in self.regexlist:
-                m = self.compiled_regexes[regex].match(remaining)
-                if m:
-                    result = m.group(0)
-                    if len(result) > len(longest_match[0]):
-                        new_priority = self.regexlist[regex][0]
-                        regex_name = self.regexlist[regex][1]
-                        longest_match = (result, regex_name, new_priority)
-                    if len(result) == len(longest_match[0]):
-                        new_priority = self.regexlist[regex][0]
-                        old_priority = longest_match[2]
-                        if new_priority < old_priority: # use token with higher priority (smaller numbers have higher priority)
-                            regex_name = self.regexlist[regex][1]
-                            longest_match = (result, regex_name, new_priority)
-            if longest_match[0] != "":
-                any_match_found = True
-                remaining = remaining[len(longest_match[0]):]
-                matches.append(longest_match)
-            else:
-                matches.append((remaining, ""))
+        while pos < end:
+            longest_match = None
+            longest_end = pos
+            for regex, groups in self.combined_regexes:
+                m = regex.match(text, pos)
+                if not m:
+                    continue
+                spans = m.regs
+                for group, name in groups:
+                    if spans[group][1] > longest_end:
+                        longest_match = name
+                        longest_end = spans[group][1]
+            if longest_match is None:
+                matches.append((text[pos:], ""))
                 break
+            any_match_found = True
+            matches.append((text[pos:longest_end], longest_match))
+            pos = longest_end
         if any_match_found:
-            stripped_priorities = []
-            for m in matches:
-                stripped_priorities.append((m[0], m[1]))
-            return stripped_priorities
+            return matches
         else:
             return [(text, '', 0)]
 
@@ -198,6 +237,7 @@ class IncrementalLexer(object):
                 debug_old.append(old_node.symbol.name)
                 debug_new.append(match[0])
                 old_node.symbol.name = match[0]
+                old_node.invalidate_length()
                 old_node.lookup = match[1]
 
                 if self.language == "Chemicals":
@@ -317,6 +357,7 @@ class IncrementalLexer(object):
                 debug_old.append(old_node.symbol.name)
                 debug_new.append(match[0])
                 old_node.symbol.name = match[0]
+                old_node.invalidate_length()
                 old_node.lookup = match[1]
 
                 if self.language == "Chemicals":
@@ -435,14 +476,7 @@ class IncrementalLexerCF(object):
         return self.indentation_based
 
     def lex(self, text):
-        tokens = self.lexer.tokenize(text)
-        return self.reformat_tokens(tokens)
-
-    def reformat_tokens(self, tokens):
-        l = []
-        for t in tokens:
-            l.append((t.source, t.name))
-        return l
+        return list(self.lexer.tokenize_pairs(text))
 
     def relex_import(self, startnode, version = 0):
         """
@@ -639,69 +673,105 @@ class IncrementalLexerCF(object):
         return nodes
 
 IncrementalLexer = IncrementalLexerCF
-import sys
 
 class StringWrapper(object):
     """
     Creates an indexable Object that returns node and all its next_terms upto an EOS, IndentationTerminal, newline or
     Magic terminal
+
+    The lexer reads the text mostly from left to right. Instead of walking the
+    terminals from the start node on every access, the wrapper remembers the
+    nodes it has already passed together with their offsets and keeps a cursor
+    to the node that was accessed last.
     """
-    # XXX This is just a temprary solution. To do this right we have to alter
-    # the lexer to work on (node, index)-tuples
 
     def __init__(self, startnode):
+        if isinstance(startnode.symbol, IndentationTerminal):
+            startnode = startnode.next_term
         self.node = startnode
         self.length = sys.maxint
+        self.nodes = []
+        self.offsets = []
+        self.cursor = 0
+        # end of the text that can be sliced, see `__getslice__`
+        self.boundary = None
+        if not isinstance(startnode, EOS):
+            self.append(startnode, 0)
 
     def __len__(self):
         return self.length
 
-    def __getitem__(self, index):
-        startindex = index
-        node = self.node
+    def is_boundary(self, node):
+        next_term = node.next_term
+        if not next_term:
+            return False
+        return isinstance(next_term, EOS) or isinstance(next_term.symbol, IndentationTerminal) or next_term.symbol.name == "\r" or isinstance(next_term.symbol, MagicTerminal)
+
+    def append(self, node, offset):
+        self.nodes.append(node)
+        self.offsets.append(offset)
+        if self.boundary is None and self.is_boundary(node):
+            self.boundary = offset + len(node.symbol.name)
+
+    def extend(self):
+        """Add the node following the last known node. Returns False if there
+        are no more nodes."""
+        node = self.nodes[-1]
+        offset = self.offsets[-1] + len(node.symbol.name)
+        node = node.next_term
+        if node is None:
+            return False
         if isinstance(node.symbol, IndentationTerminal):
             node = node.next_term
         if isinstance(node, EOS):
-            raise IndexError
+            return False
+        self.append(node, offset)
+        return True
+
+    def find(self, index):
+        """Return the position of the node containing `index` in self.nodes or
+        -1 if the text is shorter."""
+        if not self.nodes:
+            return -1
+        offsets = self.offsets
+        c = self.cursor
+        if index < offsets[c]:
+            c = bisect_right(offsets, index) - 1
+        while index >= offsets[c] + len(self.nodes[c].symbol.name):
+            c += 1
+            if c == len(self.nodes) and not self.extend():
+                return -1
+        self.cursor = c
+        return c
 
-        #move till we are in `node`
-        while index > len(node.symbol.name) - 1:
-            index -= len(node.symbol.name)
-            node = node.next_term
-            if node is None:
-                raise IndexError
-            if isinstance(node.symbol, IndentationTerminal):
-                node = node.next_term
-            if isinstance(node, EOS):
-                raise IndexError
-
-        # the startindex was a EOS, IndentationTerminal, newline or Magic terminal
-        if node.next_term and (isinstance(node.next_term, EOS) or isinstance(node.next_term.symbol, IndentationTerminal) or node.next_term.symbol.name == "\r" or isinstance(node.next_term.symbol, MagicTerminal)):
-            self.length = startindex + len(node.symbol.name[index:])
-        return node.symbol.name[index]
+    def __getitem__(self, index):
+        c = self.find(index)
+        if c < 0:
+            raise IndexError
+        node = self.nodes[c]
+        if self.is_boundary(node):
+            self.length = self.offsets[c] + len(node.symbol.name)
+        return node.symbol.name[index - self.offsets[c]]
 
     def __getslice__(self, start, stop):
+        if not self.nodes:
+            return ""
+        # slices end at the first EOS, IndentationTerminal, newline or Magic
+        # terminal even if __getitem__ has already read past it
+        while self.boundary is None and self.offsets[-1] + len(self.nodes[-1].symbol.name) < stop:
+            if not self.extend():
+                break
+        if self.boundary is not None:
+            stop = min(stop, self.boundary)
         if stop <= start:
             return ""
 
-        name = self.node.symbol.name
-        if start < len(name) and stop < len(name):
-            return name[start: stop]
-
+        c = self.find(start)
+        if c < 0:
+            return ""
         text = []
-        node = self.node
-        i = 0
-        while i < stop:
-            text.append(node.symbol.name)
-            i += len(node.symbol.name)
-            node = node.next_term
-            if isinstance(node, EOS):
-                break
-            if isinstance(node.symbol, IndentationTerminal):
-                break
-            if node.symbol.name == "\r":
-                break
-            if isinstance(node.symbol, MagicTerminal):
-                break
-
-        return "".join(text)[start:stop]
+        while c < len(self.nodes) and self.offsets[c] < stop:
+            offset = self.offsets[c]
+            text.append(self.nodes[c].symbol.name[max(start - offset, 0):stop - offset])
+            c += 1
+        return "".join(text)
@@ -261,4 +261,27 @@ class Test_CalcLexer(Test_IncrementalLexer):
                 assert wrapper[i:j] == s[i:j]
                 print(i,j,wrapper[i:j])
 
+    def test_stringwrapper_newline(self):
+        ast = AST()
+        ast.init()
+        bos = ast.parent.children[0]
+        text1 = TextNode(Terminal("ab"))
+        text2 = TextNode(Terminal("c"))
+        text3 = TextNode(Terminal("\r"))
+        text4 = TextNode(Terminal("de"))
+        bos.insert_after(text1)
+        text1.insert_after(text2)
+        text2.insert_after(text3)
+        text3.insert_after(text4)
+
+        wrapper = StringWrapper(text1)
+        assert wrapper[4] == "d"
+        assert wrapper[1] == "b"
+        assert wrapper[2] == "c"
+        assert len(wrapper) == 3
+        assert wrapper[5] == "e"
+        # slices stop at the newline
+        assert wrapper[1:] == "bc"
+        assert wrapper[3:5] == ""
+
 
@@ -20,7 +20,9 @@
 # IN THE SOFTWARE.
 
 import re
-from grammar_parser.gparser import Nonterminal, Terminal, IndentationTerminal
+from bisect import bisect_left, bisect_right
+from copy import deepcopy
+from grammar_parser.gparser import Nonterminal, Terminal, IndentationTerminal, MagicTerminal
 from syntaxtable import FinishSymbol
 
 class AST(object):
@@ -40,32 +42,72 @@ class AST(object):
     def get_bos(self):
         return self.parent.children[0]
 
-    def get_nodes_at_position(self, pos, a=None, b=None):
+    def get_nodes_at_position(self, pos):
         """
-        Searches all nodes that match the current cursor position in the TextField.
-        As a side effect all passed nodes are updated with their position in the document.
+        Returns the node containing the character before position `pos` of the
+        text and, if `pos` is at the end of that node, the node following it.
+        The positions of the returned nodes are updated as a side effect.
         """
-        print("================== get nodes at pos ================== ")
-        progress = 0
-        node = self.parent.children[0]
-        while node is not None:
-            node.position = progress
-            progress += len(node.symbol.name)
-
-            print("node", node)
-            if pos < progress:
-                return [node, None]
-
-            if pos == progress:
-                print("pos == progress")
-                other = node.next_terminal()
-                print("other", other)
-                other.position = progress
-                return [node, other]
-
-            node = node.next_terminal()
-        print ("================ end get nodes at pos ================ ")
+        if pos <= 0:
+            bos = self.get_bos()
+            other = bos.next_terminal()
+            other.position = 0
+            return [bos, other]
+        node, i = self.find_offset(pos - 1)
+        node.position = pos - 1 - i
+        if i + 1 < node.text_length():
+            return [node, None]
+        other = node.next_terminal()
+        other.position = pos
+        return [node, other]
+
+    def find_offset(self, pos):
+        """
+        Returns the terminal containing the character at offset `pos` of the
+        text of this tree and the character's offset inside that terminal. The
+        search descends along the cached subtree lengths, so it only visits the
+        path to the terminal. If `pos` is past the end of the text, EOS is
+        returned.
+        """
+        node = self.parent
+        while True:
+            children = node.text_children()
+            if not children:
+                return node, pos
+            for c in children:
+                length = c.text_length()
+                if pos < length:
+                    node = c
+                    break
+                pos -= length
+            else:
+                return self.parent.children[-1], 0
+
+    def find_line(self, line):
+        """Returns the offset at which `line` (counting from 0) starts."""
+        if line <= 0:
+            return 0
+        node = self.parent
+        offset = 0
+        while True:
+            children = node.text_children()
+            if not children:
+                # node is the newline ending the previous line
+                return offset + node.text_length()
+            for c in children:
+                newlines = c.newline_count()
+                if line <= newlines:
+                    node = c
+                    break
+                line -= newlines
+                offset += c.text_length()
+            else:
+                return offset
 
+    def find_position(self, line, column):
+        """Returns the terminal at `column` of `line` and the column's offset
+        inside it (see find_offset)."""
+        return self.find_offset(self.find_line(line) + column)
 
     def get_nodes_at_position_old(self, pos, node=None, bla=0):
         print("Progress:", self.progress, "Node", node)
@@ -152,6 +194,167 @@ class AST(object):
         self.parent.cprint(output)
         return "\n".join(output)
 
+class Record(object):
+    """The attributes of a node as they were saved in one version. Records
+    are never changed after they have been created."""
+    __slots__ = ["children", "parent", "left", "right", "next_term", "prev_term", "deleted", "indent", "name"]
+    def __init__(self, node):
+        self.children = tuple(node.children)
+        self.parent = node.parent
+        self.left = node.left
+        self.right = node.right
+        self.next_term = node.next_term
+        self.prev_term = node.prev_term
+        self.deleted = node.deleted
+        self.indent = node.indent
+        self.name = node.symbol.name
+
+def release(records):
+    """Release the pages among `records`, which are being dropped."""
+    for record in records:
+        if record.__class__ is not Record:
+            record.release()
+
+class History(object):
+    """
+    Version history of a node.
+
+    Saved versions are kept in a sorted list with a parallel list of Records,
+    so a version can be found by binary search. `changes` is the sorted list
+    of versions in which the node was changed (see Node.save_ns). Records of
+    old versions may have been moved into the undo journal, in which case a
+    Page that can load them again is stored instead (see undojournal.py).
+    Pages have to be released when their record is dropped.
+    """
+    __slots__ = ["versions", "records", "changes"]
+    def __init__(self):
+        self.versions = []
+        self.records = []
+        self.changes = []
+
+    def save(self, version, record):
+        versions = self.versions
+        if not versions or versions[-1] < version:
+            versions.append(version)
+            self.records.append(record)
+            return
+        i = bisect_left(versions, version)
+        if i < len(versions) and versions[i] == version:
+            release(self.records[i:i+1])
+            self.records[i] = record
+        else:
+            versions.insert(i, version)
+            self.records.insert(i, record)
+
+    def find(self, version):
+        """Return the record that was valid in `version`, i.e. the latest one
+        saved in or before that version, or None."""
+        i = bisect_right(self.versions, version) - 1
+        if i < 0:
+            return None
+        return self.record_at(i)
+
+    def record_at(self, i):
+        record = self.records[i]
+        if record.__class__ is not Record:
+            record = record.get(self)
+        return record
+
+    def spill(self, version, page):
+        """Replace the record saved in `version` with `page` and return it."""
+        i = bisect_left(self.versions, version)
+        if i == len(self.versions) or self.versions[i] != version:
+            return None
+        record = self.records[i]
+        if record.__class__ is not Record:
+            return None
+        self.records[i] = page
+        return record
+
+    def mark(self, version):
+        changes = self.changes
+        if not changes or changes[-1] < version:
+            changes.append(version)
+            return
+        i = bisect_left(changes, version)
+        if changes[i] != version:
+            changes.insert(i, version)
+
+    @property
+    def changes_count(self):
+        return len(self.changes)
+
+    @changes_count.setter
+    def changes_count(self, count):
+        # used by the parser to undo marks of the current version, which
+        # are always the last ones
+        del self.changes[count:]
+
+    def unmark(self, version):
+        """Drop the marks of `version` and later versions."""
+        del self.changes[bisect_left(self.changes, version):]
+
+    def has_changes(self, version):
+        changes = self.changes
+        i = bisect_left(changes, version)
+        return i < len(changes) and changes[i] == version
+
+    def truncate(self, version):
+        """Forget everything that was saved or changed after `version`."""
+        i = bisect_right(self.versions, version)
+        del self.versions[i:]
+        release(self.records[i:])
+        del self.records[i:]
+        del self.changes[bisect_right(self.changes, version):]
+
+    def compact(self, start, end):
+        """Merge the records saved after `start` up to `end` into a single one
+        saved in `end`."""
+        versions = self.versions
+        i = bisect_right(versions, start)
+        j = bisect_right(versions, end)
+        if j > i:
+            versions[i:j] = [end]
+            release(self.records[i:j-1])
+            self.records[i:j] = [self.records[j-1]]
+        changes = self.changes
+        del changes[bisect_left(changes, start):bisect_left(changes, end)]
+
+    def forget(self, version):
+        """Drop everything that is not needed to go back to `version` or to
+        a later version."""
+        i = bisect_right(self.versions, version) - 1
+        if i > 0:
+            del self.versions[:i]
+            release(self.records[:i])
+            del self.records[:i]
+        if i >= 0 and self.records[0].__class__ is not Record:
+            # load the record back, otherwise it would keep the page of a
+            # forgotten version alive
+            page = self.records[0]
+            self.records[0] = page.get(self)
+            page.release()
+        del self.changes[:bisect_left(self.changes, version)]
+
+    def __deepcopy__(self, memo):
+        # pages hold the records by the id of the history, so the copy gets
+        # its own records instead
+        history = History()
+        memo[id(self)] = history
+        history.versions = list(self.versions)
+        history.records = [deepcopy(self.record_at(i), memo)
+                           for i in xrange(len(self.records))]
+        history.changes = list(self.changes)
+        return history
+
+    def max_version(self):
+        m = 0
+        if self.versions:
+            m = self.versions[-1]
+        if self.changes:
+            m = max(m, self.changes[-1])
+        return m
+
 class Node(object):
     __slots__ = ["symbol", "state", "parent", "left", "right", "prev_term", "next_term", "magic_parent", "children", "annotations"]
     def __init__(self, symbol, state, children):
@@ -168,7 +371,7 @@ class Node(object):
         self.next_term = None
         self.magic_parent = None
         self.set_children(children)
-        self.log = {}
+        self.log = History()
         self.annotations = []
 
     def add_annotation(self, annotation):
@@ -195,7 +398,9 @@ class Node(object):
 
     def save_ns(self, setchildren=False):
         from treemanager import TreeManager
-        self.log[("ns", TreeManager.version)] = True
+        self.log.mark(TreeManager.version)
+        if TreeManager.journal is not None:
+            TreeManager.journal[id(self)] = self
 
     def mark_changed(self):
         node = self
@@ -241,41 +446,34 @@ class Node(object):
             #XXX need to save this?
 
     def save(self, version):
-        self.log[("children", version)] = list(self.children)
-        self.log[("parent", version)] = self.parent
-        self.log[("left", version)] = self.left
-        self.log[("right", version)] = self.right
-        self.log[("next_term", version)] = self.next_term
-        self.log[("prev_term", version)] = self.prev_term
-        self.log[("deleted", version)] = self.deleted
-        self.log[("indent", version)] = self.indent
+        self.log.save(version, Record(self))
         self.version = version
 
     def load(self, version):
-        while version >= 0:
-            if ("parent", version) in self.log:
-                self.parent = self.log[("parent", version)]
-                self.children = list(self.log[("children", version)])
-                self.left = self.log[("left", version)]
-                self.right = self.log[("right", version)]
-                self.next_term = self.log[("next_term", version)]
-                self.prev_term = self.log[("prev_term", version)]
-                self.deleted = self.log[("deleted", version)]
-                self.indent = self.log[("indent", version)]
-                self.version = version
-                return
-            version -= 1
+        i = bisect_right(self.log.versions, version) - 1
+        if i < 0:
+            return
+        record = self.log.record_at(i)
+        self.parent = record.parent
+        self.children = list(record.children)
+        self.left = record.left
+        self.right = record.right
+        self.next_term = record.next_term
+        self.prev_term = record.prev_term
+        self.deleted = record.deleted
+        self.indent = record.indent
+        self.version = self.log.versions[i]
 
     def get_attr(self, attr, version):
         if version is None:
             return self.__getattribute__(attr)
         version = int(version)
-        while version >= 0:
-            try:
-                return self.log[(attr, version)]
-            except KeyError:
-                version -= 1
-        raise AttributeError("Attribute %s for version %s not found." % (attr, version))
+        if attr == "symbol.name":
+            attr = "name"
+        record = self.log.find(version)
+        if record is None or attr not in Record.__slots__:
+            raise AttributeError("Attribute %s for version %s not found." % (attr, version))
+        return getattr(record, attr)
 
     def remove_child(self, child):
         for i in xrange(len(self.children)):
@@ -356,6 +554,17 @@ class Node(object):
             else:
                 last = siblings[i]
 
+    def cached_first_terminal(self):
+        """
+        Return the leftmost terminal of this subtree. Nonterminals remember
+        their leftmost terminal when the parser creates them, which stays
+        valid as long as the node is not marked as changed. Otherwise (or for
+        empty subtrees) fall back to walking the tree.
+        """
+        if self.first_term is not None and not self.changed:
+            return self.first_term
+        return self.find_first_terminal()
+
     def find_first_terminal(self):
         node = self
         while isinstance(node.symbol, Nonterminal):
@@ -452,12 +661,16 @@ uppercase = set(list(string.ascii_uppercase))
 digits = set(list(string.digits))
 
 class TextNode(Node):
-    __slots__ = ["log", "version", "position", "changed", "deleted", "image", "image_src", "plain_mode", "alternate", "lookahead", "lookup", "parent_lbox", "magic_backpointer", "indent"]
+    __slots__ = ["log", "version", "position", "changed", "deleted", "image", "image_src", "plain_mode", "_alternate", "production", "lookahead", "lookup", "parent_lbox", "magic_backpointer", "indent", "first_term", "textlen", "newlines", "textcache", "generation"]
     def __init__(self, symbol, state=-1, children=[], pos=-1, lookahead=0):
         """
 
         :type symbol: grammar_parser.gparser.Symbol
         """
+        self.textlen = None
+        self.newlines = 0
+        self.textcache = None
+        self.generation = 0 # last parse that recorded this node for rollback
         Node.__init__(self, symbol, state, children)
         self.position = 0
         self.changed = False
@@ -465,12 +678,90 @@ class TextNode(Node):
         self.image = None
         self.image_src = None
         self.plain_mode = False
-        self.alternate = None
+        self._alternate = None
+        self.production = None
         self.lookahead = lookahead
         self.lookup = ""
-        self.log = {}
         self.version = 0
         self.indent = None
+        self.first_term = None
+
+    # The alternate of a node is its folded version or the AST built from its
+    # grammar annotation. The parser only stores the production that created
+    # the node, and the alternate is built when it is first asked for. The
+    # pending alternates below the node are built before it, bottom-up, so
+    # that deep trees don't exceed the recursion limit.
+
+    @property
+    def alternate(self):
+        if self.production is not None:
+            self.build_alternates()
+        return self._alternate
+
+    @alternate.setter
+    def alternate(self, alternate):
+        self._alternate = alternate
+        self.production = None
+
+    def set_production(self, production):
+        self._alternate = None
+        self.production = production
+
+    def has_alternate(self):
+        """Return True if the alternate has been built or is pending."""
+        return self._alternate is not None or self.production is not None
+
+    def build_alternates(self):
+        pending = []
+        todo = [self]
+        while todo:
+            node = todo.pop()
+            if node.production is not None:
+                pending.append(node)
+                todo.extend(node.children)
+        for node in reversed(pending):
+            production = node.production
+            node.production = None
+            annotation = production.annotation
+            if getattr(annotation, "interpret", None):
+                # eco grammar annotations
+                node._alternate = annotation.interpret(node)
+            else:
+                # johnstone annotations
+                node._alternate = node.fold(production)
+
+    def fold(self, production):
+        """Return the folded version of this node, which was created by
+        `production`."""
+        alternate = TextNode(self.symbol.__class__(self.symbol.name), self.state, [])
+        alternate.children = []
+        teared = []
+        for i in range(len(self.children)):
+            if production.inserts.has_key(i):
+                # insert tiered nodes at right position
+                value = production.inserts[i]
+                for t in teared:
+                    if t.symbol.name == value.name:
+                        alternate.children.append(t)
+            c = self.children[i]
+            folding = production.right[i].folding
+            if folding == "^^^":
+                teared.append(c)
+                continue
+            elif folding == "^^":
+                while c.alternate is not None:
+                    c = c.alternate
+                alternate.symbol = c.symbol
+                for child in c.children:
+                    alternate.children.append(child)
+            elif folding == "^":
+                while c.alternate is not None:
+                    c = c.alternate
+                for child in c.children:
+                    alternate.children.append(child)
+            else:
+                alternate.children.append(c)
+        return alternate
 
     def get_magicterminal(self):
         try:
@@ -514,17 +805,93 @@ class TextNode(Node):
     def change_pos(self, i):
         self.pos += i
 
+    # Every node with children caches the length of the text below it and
+    # the number of newlines in it. The caches are computed when needed and
+    # are reset whenever a node is changed (see save_ns), which also resets
+    # the caches of all nodes above it. Language boxes count with the text of
+    # their contents, indentation terminals, BOS and EOS count as empty.
+    # Nodes may also cache their text (see textsearch.py), which is reset
+    # together with the lengths.
+
+    def text_children(self):
+        if isinstance(self.symbol, MagicTerminal):
+            root = getattr(self.symbol, "ast", None)
+            if root is None:
+                return []
+            return [root]
+        return self.children
+
+    def text_length(self):
+        if not self.text_children():
+            if self.symbol.__class__ is Terminal:
+                return len(self.symbol.name)
+            return 0
+        if self.textlen is None:
+            self.update_lengths()
+        return self.textlen
+
+    def newline_count(self):
+        if not self.text_children():
+            if self.symbol.__class__ is Terminal and self.symbol.name == "\r":
+                return 1
+            return 0
+        if self.textlen is None:
+            self.update_lengths()
+        return self.newlines
+
+    def update_lengths(self):
+        stack = [self]
+        while stack:
+            node = stack[-1]
+            children = node.text_children()
+            pending = [c for c in children if c.textlen is None and c.text_children()]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            length = newlines = 0
+            for c in children:
+                length += c.text_length()
+                newlines += c.newline_count()
+            node.textlen = length
+            node.newlines = newlines
+
+    def invalidate_length(self):
+        self.textlen = None
+        self.textcache = None
+        node = self.get_parent()
+        while node is not None and node.textlen is not None:
+            node.textlen = None
+            node.textcache = None
+            node = node.get_parent()
+
+    def text_offset(self):
+        """Return the offset of this node in the text of the whole document,
+        including the text of all language boxes around it."""
+        offset = 0
+        node = self
+        parent = node.get_parent()
+        while parent is not None:
+            for c in parent.text_children():
+                if c is node:
+                    break
+                offset += c.text_length()
+            node = parent
+            parent = node.get_parent()
+        return offset
+
+    def save_ns(self, setchildren=False):
+        Node.save_ns(self, setchildren)
+        self.invalidate_length()
+
     def change_text(self, text):
         _cls = self.symbol.__class__
         self.symbol = _cls(text)
         self.mark_version()
 
-    def save(self, version):
-        Node.save(self, version)
-        self.log[("symbol.name", version)] = self.symbol.name
-
     def load(self, version):
         Node.load(self, version)
+        self.invalidate_length()
         if not isinstance(self.symbol, Terminal):
             return
         text = self.get_text(version)
@@ -537,17 +904,13 @@ class TextNode(Node):
         if version is None:
             from treemanager import TreeManager
             version = TreeManager.version
-        return self.log.has_key(("ns", version))
+        return self.log.has_changes(version)
 
     def get_text(self, version):
-        while True:
-            try:
-                return self.log[("symbol.name", version)]
-            except KeyError:
-                version -= 1
-                if version == -1:
-                    return None
-                continue
+        record = self.log.find(version)
+        if record is None:
+            return None
+        return record.name
 
     def insert(self, char, pos):
         l = list(self.symbol.name)
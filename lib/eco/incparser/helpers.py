@@ -41,6 +41,11 @@ class Helper(object):
         self.calculate_first()
         self.calculate_follow()
         self.goto_count = {}
+        # closure_1 caches (see closure_templates)
+        self.closure_cache = {}
+        self.items = {}
+        self.templates = {}
+        self.suffix_first = {}
 
 
     def first(self, symbol):
@@ -169,66 +174,137 @@ class Helper(object):
                 result.add(new_state)
         return self.closure_0(result)
 
+    def alternatives(self, symbol):
+        """Return the (interned) closure items created for each alternative of
+        `symbol`."""
+        try:
+            return self.items[symbol]
+        except KeyError:
+            pass
+        rule = self.grammar[symbol]
+        items = []
+        for i, a in enumerate(rule.alternatives):
+            # create epsilon symbol if alternative is empty
+            if a == []:
+                a = [Epsilon()]
+            p = Production(symbol, a, rule.annotations[i], rule.precs[i])
+            if rule.inserts.has_key(i):
+                insert = rule.inserts[i]
+                p.inserts[insert[0]] = insert[1]
+            if a == [epsilon]:
+                items.append(LR0Element(p, 1))
+            else:
+                items.append(LR0Element(p, 0))
+        self.items[symbol] = items
+        return items
+
+    def first_of_suffix(self, element):
+        """
+        Return FIRST of the symbols following the next symbol of `element`
+        (without epsilon) and whether these symbols are nullable, i.e. if the
+        lookahead of `element` needs to be added as well.
+        """
+        try:
+            return self.suffix_first[element]
+        except KeyError:
+            pass
+        f = set()
+        nullable = True
+        for symbol in element.remaining_symbols():
+            first = self.first(symbol)
+            f |= first
+            if epsilon not in first:
+                nullable = False
+                break
+        f.discard(epsilon)
+        result = self.suffix_first[element] = (f, nullable)
+        return result
+
+    def closure_templates(self, symbol):
+        """
+        Return the closure items that are added for every element whose next
+        symbol is `symbol`. The lookahead of each item consists of a
+        spontaneous part which doesn't depend on the lookahead of that element
+        and, if the item propagates, the lookahead of the element.
+        """
+        try:
+            return self.templates[symbol]
+        except KeyError:
+            pass
+        # the lookahead of the element is represented by None
+        la_dict = {}
+        order = []
+        todo = []
+        for s in self.alternatives(symbol):
+            la_dict[s] = set([None])
+            order.append(s)
+            todo.append(s)
+        while todo:
+            state = todo.pop()
+            if state.isfinal():
+                continue
+            symbol2 = state.next_symbol()
+            if not isinstance(symbol2, Nonterminal):
+                continue
+            f, nullable = self.first_of_suffix(state)
+            if nullable:
+                f = f | la_dict[state]
+            for s in self.alternatives(symbol2):
+                if s in la_dict:
+                    if f.issubset(la_dict[s]):
+                        continue
+                    la_dict[s] |= f
+                else:
+                    la_dict[s] = set(f)
+                    order.append(s)
+                todo.append(s)
+        templates = []
+        for s in order:
+            la = la_dict[s]
+            templates.append((s, la - set([None]), None in la))
+        self.templates[symbol] = templates
+        return templates
+
     def closure_1(self, state_set):
+        # closures are memoized by their kernel including lookaheads
+        key = frozenset([(e, frozenset(state_set.get_lookahead(e))) for e in state_set.elements])
+        try:
+            final_result = self.closure_cache[key]
+        except KeyError:
+            final_result = self.closure_cache[key] = self.calculate_closure_1(state_set)
+        # callers may add elements to the result, so return a copy
+        result = StateSet(set(final_result.elements))
+        result.lookaheads = dict(final_result.lookaheads)
+        return result
+
+    def calculate_closure_1(self, state_set):
         la_dict = {}
-        result = set()
-        working_set = set()
-        # Step 1
+        order = []
+        kernel = []
         for element in state_set.elements:
-            la_dict[element] = state_set.get_lookahead(element)
-            result.add(element)
-            working_set.add(element)
-        # Step 2
-        i=0
-        temp = working_set
-        while 1:
-            newelements = set()
-            for state in temp:
-                if state.isfinal():
-                    continue
-                symbol = state.next_symbol()
-                if isinstance(symbol, Nonterminal):
-                    f = set()
-                    for l in la_dict[state]:
-                        betaL = []
-                        betaL.extend(state.remaining_symbols())
-                        betaL.append(l)
-                        f |= self.first(betaL)
-                    alternatives = self.grammar[symbol].alternatives
-                    i = -1
-                    for a in alternatives:
-                        i = i + 1
-                        # create epsilon symbol if alternative is empty
-                        if a == []:
-                            a = [Epsilon()]
-                        p = Production(symbol, a, self.grammar[symbol].annotations[i], self.grammar[symbol].precs[i])
-                        if self.grammar[symbol].inserts.has_key(i):
-                            insert = self.grammar[symbol].inserts[i]
-                            p.inserts[insert[0]] = insert[1]
-                        s = LR0Element(p, 0)
-                        if a == [epsilon]:
-                            s.d = 1
-                        # NEW ELEMENT:
-                        # 1. completely new (+lookahead): add to result
-                        # 2. new lookahead: update lookahead in la_dict
-                        # -> add to new working set
-                        # 3. already known: ignore
-                        if s in result:
-                            if f.issubset(la_dict[s]):   # lookahead in combination with state already known
-                                continue
-                            else:
-                                la_dict[s] |= f   # new lookahead
-                        else:
-                            la_dict[s] = set(f)        # completely new
-                        result.add(s)
-                        newelements.add(s)
-            temp = newelements
-            if len(temp) == 0:
-                break
-            i += 1
+            la_dict[element] = set(state_set.get_lookahead(element))
+            order.append(element)
+            if not element.isfinal() and isinstance(element.next_symbol(), Nonterminal):
+                kernel.append(element)
+        # a template already contains everything reachable from its items, so
+        # a kernel element that receives lookaheads from another kernel
+        # element's closure doesn't need to be looked at again
+        for element in kernel:
+            f, nullable = self.first_of_suffix(element)
+            if nullable:
+                f = f | la_dict[element]
+            for s, spontaneous, propagates in self.closure_templates(element.next_symbol()):
+                try:
+                    la = la_dict[s]
+                except KeyError:
+                    la = la_dict[s] = set()
+                    order.append(s)
+                la |= spontaneous
+                if propagates:
+                    la |= f
         # add lookaheads
         final_result = StateSet()
-        for element in result:
+        for element in order:
             final_result.add(element, la_dict[element])
         return final_result
 
@@ -242,9 +318,7 @@ class Helper(object):
         for state in state_set:
             s = state.next_symbol()
             if s == symbol:
-                new_state = state.clone()
-                new_state.d += 1
-                result.add(new_state)
+                result.add(state.advance())
         print("goto END")
         return self.closure_1(result)
 
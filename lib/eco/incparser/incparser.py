@@ -21,19 +21,16 @@
 
 from __future__ import print_function
 
-try:
-    import cPickle as pickle
-except:
-    import pickle
-
-import time, os
-
 from grammar_parser.gparser import Parser, Nonterminal, Terminal, Epsilon, IndentationTerminal
 from syntaxtable import SyntaxTable, FinishSymbol, Reduce, Accept, Shift
+from syntaxtable import SHIFT, GOTO, REDUCE, ACCEPT, ACTION_BITS, ACTION_MASK
 from stategraph import StateGraph
+from lalr import LALRGraph
+from tablecache import cache, make_key
 from constants import LR0, LALR
 from astree import AST, TextNode, BOS, EOS
 from ip_plugins.plugin import PluginManager
+from tracing import TRACE, tracer
 
 import logging
 
@@ -57,41 +54,26 @@ class IncParser(object):
     """
     The incremental parser
     """
+    generation = 0 # number of the last parse, see reduce
     def __init__(self, grammar=None, lr_type=LR0, whitespaces=False, startsymbol=None):
 
+        self._graph = None
+        self._graph_source = None
         if grammar:
-            logging.debug("Parsing Grammar")
-            parser = Parser(grammar, whitespaces)
-            parser.parse()
-
-            filename = "".join([os.path.dirname(__file__), "/../pickle/", str(hash(grammar) ^ hash(whitespaces)), ".pcl"])
-            try:
-                logging.debug("Try to unpickle former stategraph")
-                f = open(filename, "r")
-                start = time.time()
-                self.graph = pickle.load(f)
-                end = time.time()
-                logging.debug("unpickling done in %s", end-start)
-            except IOError:
-                logging.debug("could not unpickle old graph")
-                logging.debug("Creating Stategraph")
-                self.graph = StateGraph(parser.start_symbol, parser.rules, lr_type)
-                logging.debug("Building Stategraph")
-                self.graph.build()
-                logging.debug("Pickling")
-                pickle.dump(self.graph, open(filename, "w"))
-
-            if lr_type == LALR:
-                self.graph.convert_lalr()
-
-            logging.debug("Creating Syntaxtable")
-            self.syntaxtable = SyntaxTable(lr_type)
-            self.syntaxtable.build(self.graph)
+            key = make_key(grammar, lr_type, whitespaces)
+            self._graph_source = (grammar, lr_type, whitespaces)
+            self.syntaxtable = cache.load(key)
+            if self.syntaxtable is None:
+                logging.debug("Creating Syntaxtable")
+                self.syntaxtable = SyntaxTable(lr_type)
+                self.syntaxtable.build(self.graph)
+                cache.store(key, self.syntaxtable)
 
         self.stack = []
         self.ast_stack = []
         self.all_changes = []
         self.undo = []
+        self.undo_reused = []
         self.last_shift_state = 0
         self.validating = False
         self.last_status = False
@@ -99,35 +81,77 @@ class IncParser(object):
         self.whitespaces = whitespaces
         self.status_by_version = {}
         self.errornode_by_version = {}
-        self.indentation_based = False
+        self._indentation_based = False
 
         self.pm = PluginManager()
         self.pm.loadplugins(self)
-        self.pm.do_incparse_init()
+        if self.pm.do_incparse_init:
+            self.pm.do_incparse_init()
 
         self.previous_version = None
+        self.treemanager = None # the document using this parser, see inc_parse
         logging.debug("Incremental parser done")
 
+    @property
+    def indentation_based(self):
+        return self._indentation_based
+
+    @indentation_based.setter
+    def indentation_based(self, value):
+        # plugins may only apply to indentation based languages
+        self._indentation_based = value
+        self.pm.update(self)
+
+    @property
+    def graph(self):
+        """The StateGraph of this parser. If the syntax table was loaded from
+        the cache the graph is only rebuilt on demand (e.g. by the viewer)."""
+        if self._graph is None and self._graph_source is not None:
+            grammar, lr_type, whitespaces = self._graph_source
+            logging.debug("Parsing Grammar")
+            parser = Parser(grammar, whitespaces)
+            parser.parse()
+
+            logging.debug("Creating Stategraph")
+            if lr_type == LALR:
+                self._graph = LALRGraph(parser.start_symbol, parser.rules)
+            else:
+                self._graph = StateGraph(parser.start_symbol, parser.rules, lr_type)
+            logging.debug("Building Stategraph")
+            self._graph.build()
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph):
+        self._graph = graph
+
     def from_dict(self, rules, startsymbol, lr_type, whitespaces, pickle_id, precedences):
+        """
+        Create the syntax table from a dictionary of rules.
+
+        :param pickle_id: stable digest of the grammar (see EcoFile.digest),
+                          used as key into the table cache. If None, the table
+                          isn't cached.
+        """
         self.graph = None
         self.syntaxtable = None
         if pickle_id:
-            filename = "".join([os.path.dirname(__file__), "/../pickle/", str(pickle_id ^ hash(whitespaces)), ".pcl"])
-            try:
-                f = open(filename, "r")
-                self.syntaxtable = pickle.load(f)
-            except IOError:
-                pass
+            key = make_key(pickle_id, lr_type, whitespaces, precedences)
+            self.syntaxtable = cache.load(key)
         if self.syntaxtable is None:
-            self.graph = StateGraph(startsymbol, rules, lr_type)
+            if lr_type == LALR:
+                self.graph = LALRGraph(startsymbol, rules)
+            else:
+                self.graph = StateGraph(startsymbol, rules, lr_type)
             self.graph.build()
             self.syntaxtable = SyntaxTable(lr_type)
             self.syntaxtable.build(self.graph, precedences)
             if pickle_id:
-                pickle.dump(self.syntaxtable, open(filename, "w"))
+                cache.store(key, self.syntaxtable)
 
         self.whitespaces = whitespaces
-        self.pm.do_incparse_from_dict(rules)
+        if self.pm.do_incparse_from_dict:
+            self.pm.do_incparse_from_dict(rules)
 
     def init_ast(self, magic_parent=None):
         bos = BOS(Terminal(""), 0, [])
@@ -146,11 +170,17 @@ class IncParser(object):
         self.inc_parse([], True)
 
     def inc_parse(self, line_indents=[], reparse=False):
+        if self.treemanager is not None:
+            # the changed nodes have to be journalled by this parser's document
+            self.treemanager.activate()
         logging.debug("============ NEW INCREMENTAL PARSE ================= ")
         self.validating = False
         self.error_node = None
         self.stack = []
         self.undo = []
+        self.undo_reused = []
+        IncParser.generation += 1
+        self.generation = IncParser.generation
         self.current_state = 0
         self.stack.append(Node(FinishSymbol(), 0, []))
         bos = self.previous_version.parent.children[0]
@@ -158,19 +188,23 @@ class IncParser(object):
 
         USE_OPT = True
 
-        self.pm.do_incparse_inc_parse_top()
+        if self.pm.do_incparse_inc_parse_top:
+            self.pm.do_incparse_inc_parse_top()
+        if TRACE:
+            tracer.record("parse", self, self.generation, reparse)
 
         la = self.pop_lookahead(bos)
         while(True):
-            logging.debug("\x1b[35mProcessing\x1b[0m %s %s %s %s", la, la.changed, id(la), la.indent)
             self.loopcount += 1
             if isinstance(la.symbol, Terminal) or isinstance(la.symbol, FinishSymbol) or la.symbol == Epsilon():
                 if la.changed:
                     assert False # with prelexing you should never end up here!
                 else:
-                    lookup_symbol = self.get_lookup(la)
-                    result = self.parse_terminal(la, lookup_symbol)
+                    lookup_id = self.get_lookup(la)
+                    result = self.parse_terminal(la, lookup_id)
                     if result == "Accept":
+                        self.undo = []
+                        self.undo_reused = []
                         self.last_status = True
                         return True
                     elif result == "Error":
@@ -183,33 +217,35 @@ class IncParser(object):
                 if la.changed or reparse:
                     # deconstruct the
                     #la.changed = False # as all nonterminals that have changed are being rebuild, there is no need to change this flag (this also solves problems with comments)
-                    self.undo.append((la, 'changed', True))
                     la = self.left_breakdown(la)
                 else:
                     if USE_OPT:
                         #Follow parsing/syntax table
-                        goto = self.syntaxtable.lookup(self.current_state, la.symbol)
+                        goto = self.syntaxtable.lookup_id(self.current_state, self.syntaxtable.nonterminal_ids.get(la.symbol.name, 0))
                         if goto: # can we shift this Nonterminal in the current state?
-                            logging.debug("OPTShift: %s in state %s -> %s", la.symbol, self.current_state, goto)
-                            self.pm.do_incparse_optshift(la)
-                            follow_id = goto.action
+                            follow_id = goto >> ACTION_BITS
+                            if TRACE:
+                                tracer.record("optshift", self, id(la), la.symbol.name, self.current_state, follow_id)
+                            if self.pm.do_incparse_optshift:
+                                self.pm.do_incparse_optshift(la)
                             self.stack.append(la)
                             la.state = follow_id #XXX this fixed goto error (I should think about storing the states on the stack instead of inside the elements)
                             self.current_state = follow_id
-                            logging.debug("USE_OPT: set state to %s", self.current_state)
                             la = self.pop_lookahead(la)
                             self.validating = True
                             continue
-                        else:
-                            #XXX can be made faster by providing more information in syntax tables
-                            first_term = la.find_first_terminal()
+                        elif self.syntaxtable.reducing_states[self.current_state]:
+                            first_term = la.cached_first_terminal()
 
-                            lookup_symbol = self.get_lookup(first_term)
-                            element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
-                            if isinstance(element, Reduce):
-                                self.reduce(element)
+                            lookup_id = self.get_lookup(first_term)
+                            element = self.syntaxtable.lookup_id(self.current_state, lookup_id)
+                            if element & ACTION_MASK == REDUCE:
+                                self.reduce(element >> ACTION_BITS)
                             else:
                                 la = self.left_breakdown(la)
+                        else:
+                            # nothing to reduce in this state
+                            la = self.left_breakdown(la)
                     else:
                         # PARSER WITHOUT OPTIMISATION
                         if la.lookup != "":
@@ -219,7 +255,6 @@ class IncParser(object):
                         element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
 
                         if self.shiftable(la):
-                            logging.debug("\x1b[37mis shiftable\x1b[0m")
                             self.stack.append(la)
                             self.current_state = la.state
                             self.right_breakdown()
@@ -228,87 +263,194 @@ class IncParser(object):
                             la = self.left_breakdown(la)
         logging.debug("============ INCREMENTAL PARSE END ================= ")
 
-    def parse_terminal(self, la, lookup_symbol):
+    def bulk_load(self, tokens, version=0):
+        """
+        Build the parse tree of a new file from the tokens of the lexer.
+
+        As there is no previous version of the tree that could be reused, this
+        runs a plain LR parse directly on the terminals: nothing is recorded
+        for undo, no versions are marked and plugins are only notified before
+        the parse and on reductions. If the tokens are not syntactically
+        correct the tree is left unchanged, so the caller can fall back to
+        the incremental parser, which handles errors.
+
+        :param tokens: list of (text, lookup) pairs, e.g. from IncrementalLexer.lex
+        :param version: version assigned to each created node
+        :return: True if the tokens were accepted, False otherwise
+        """
+        logging.debug("============ BULK LOAD ================= ")
+        root = self.previous_version.parent
+        bos = root.children[0]
+        eos = root.children[-1]
+        last = bos
+        for match in tokens:
+            node = TextNode(Terminal(match[0]))
+            node.version = version
+            node.lookup = match[1]
+            node.prev_term = last
+            last.next_term = node
+            last = node
+        last.next_term = eos
+        eos.prev_term = last
+
+        if self.pm.do_incparse_bulk_load_top:
+            self.pm.do_incparse_bulk_load_top()
+
+        self.validating = False
+        self.error_node = None
+        self.undo = []
+        self.stack = [Node(FinishSymbol(), 0, [])]
+        stack = self.stack
+        syntaxtable = self.syntaxtable
+        actions = syntaxtable.actions
+        width = syntaxtable.width
+        terminal_ids = syntaxtable.terminal_ids
+        reduce_hook = self.pm.do_incparse_reduce
+        state = 0
+        la = bos.next_term
+        while True:
+            if la is eos:
+                element = actions[state * width + syntaxtable.eos_id]
+                if element & ACTION_MASK == SHIFT:
+                    state = element >> ACTION_BITS
+                    continue
+                if not element:
+                    element = actions[state * width + self.get_lookup(la)]
+            elif la.lookup != "":
+                element = actions[state * width + terminal_ids.get(la.lookup, 0)]
+            else:
+                element = actions[state * width + syntaxtable.symbol_id(la.symbol)]
+            action = element & ACTION_MASK
+            if action == SHIFT:
+                state = element >> ACTION_BITS
+                la.state = state
+                stack.append(la)
+                if la.lookup != "<ws>":
+                    self.last_shift_state = state
+                la = la.next_term
+            elif action == REDUCE:
+                rule_id = element >> ACTION_BITS
+                production = syntaxtable.reductions[rule_id].action
+                amount = syntaxtable.reduce_amounts[rule_id]
+                children = stack[len(stack)-amount:]
+                del stack[len(stack)-amount:]
+                for i in range(amount):
+                    children[i].symbol.folding = production.right[i].folding
+                state = stack[-1].state
+                goto = actions[state * width + syntaxtable.reduce_gotos[rule_id]]
+                if not goto:
+                    raise Exception("Reduction error on %s in state %s: goto is None" % (production, state))
+                new_node = Node(production.left.copy(), goto >> ACTION_BITS, children)
+                for c in children:
+                    if not isinstance(c.symbol, Nonterminal):
+                        new_node.first_term = c
+                        break
+                    if c.children:
+                        new_node.first_term = c.first_term
+                        break
+                if reduce_hook:
+                    reduce_hook(new_node)
+                stack.append(new_node)
+                state = new_node.state
+                new_node.set_production(production)
+            elif action == ACCEPT:
+                root.set_children([bos, stack[1], eos])
+                self.current_state = state
+                self.last_status = True
+                logging.debug("============ BULK LOAD END ================= ")
+                return True
+            else:
+                break
+
+        # syntax error: leave the tree as it was, so the caller can fall back
+        # to inc_parse, which knows how to handle errors
+        logging.debug("Bulk load failed on %s", la)
+        bos.next_term = eos
+        eos.prev_term = bos
+        self.stack = []
+        return False
+
+    def parse_terminal(self, la, lookup_id):
         """
         Take in one terminal and set it's state to the state the parsing is in at the moment this terminal
         has been read.
 
         :param la: lookahead
-        :param lookup_symbol:
+        :param lookup_id: interned id of the lookahead's lookup (see get_lookup)
         :return: "Accept" is the code was accepted as valid, "Error" if the syntax table does not provide a next state
         """
-        element = None
+        element = 0
         if isinstance(la, EOS):
-            element = self.syntaxtable.lookup(self.current_state, Terminal("<eos>"))
-            if isinstance(element, Shift):
-                self.current_state = element.action
+            element = self.syntaxtable.lookup_id(self.current_state, self.syntaxtable.eos_id)
+            if element & ACTION_MASK == SHIFT:
+                self.current_state = element >> ACTION_BITS
                 return la
-        if element is None:
-            element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
-        logging.debug("\x1b[34mparse_terminal\x1b[0m: %s in %s -> %s", lookup_symbol, self.current_state, element)
-        if isinstance(element, Accept):
+        if not element:
+            element = self.syntaxtable.lookup_id(self.current_state, lookup_id)
+        action = element & ACTION_MASK
+        if action == ACCEPT:
             #XXX change parse so that stack is [bos, startsymbol, eos]
             bos = self.previous_version.parent.children[0]
             eos = self.previous_version.parent.children[-1]
             self.previous_version.parent.set_children([bos, self.stack[1], eos])
-            logging.debug("loopcount: %s", self.loopcount)
-            logging.debug ("\x1b[32mAccept\x1b[0m")
+            if TRACE:
+                tracer.record("accept", self, self.loopcount)
             return "Accept"
-        elif isinstance(element, Shift):
+        elif action == SHIFT:
             self.validating = False
-            self.shift(la, element)
+            self.shift(la, element >> ACTION_BITS)
             return self.pop_lookahead(la)
 
-        elif isinstance(element, Reduce):
-            logging.debug("\x1b[33mReduce\x1b[0m: %s -> %s", la, element)
-            self.reduce(element)
-            return self.parse_terminal(la, lookup_symbol)
-        elif element is None:
+        elif action == REDUCE:
+            self.reduce(element >> ACTION_BITS)
+            return self.parse_terminal(la, lookup_id)
+        elif not element:
             if self.validating:
-                logging.debug("Was validating: Right breakdown and return to normal")
-                logging.debug("Before breakdown: %s", self.stack[-1])
+                # was validating: right breakdown and return to normal
                 self.right_breakdown()
-                logging.debug("After breakdown: %s", self.stack[-1])
                 self.validating = False
             else:
                 return self.do_undo(la)
 
     def get_lookup(self, la):
         """
-        Retrurn the lookup of a node as Terminal. The lookup is name of the regular expression that mached the
+        Return the lookup of a node as an interned symbol id of the syntax
+        table. The lookup is name of the regular expression that mached the
         token in the lexing phase.
 
-        Note: indentation terminals are handled in a special manner
+        Note: indentation terminals are looked up as normal terminals
 
         :param la: node to find lookup of
-        :return: the lookup of the node wraped in a Terminal
+        :return: the id of the node's lookup (0 if the table doesn't know it)
         """
         if la.lookup != "":
-            lookup_symbol = Terminal(la.lookup)
-        else:
-            lookup_symbol = la.symbol
-        if isinstance(lookup_symbol, IndentationTerminal):
-            #XXX hack: change parsing table to accept IndentationTerminals
-            lookup_symbol = Terminal(lookup_symbol.name)
-        return lookup_symbol
+            return self.syntaxtable.terminal_ids.get(la.lookup, 0)
+        return self.syntaxtable.symbol_id(la.symbol)
 
     def do_undo(self, la):
         """
         Restore changes
 
-        Loop over self.undo and for the tupel (a,b,c) do a.b = c
+        Restore the attributes of all nodes recorded by reduce
         :param la:
         :return:
         """
-        while len(self.undo) > 0:
-            node, attribute, value = self.undo.pop(-1)
-            setattr(node, attribute, value)
+        for node, parent, left, right, changes_count in self.undo:
+            node.parent = parent
+            node.left = left
+            node.right = right
+            node.log.changes_count = changes_count
+        for node, changed, indent in reversed(self.undo_reused):
+            node.changed = changed
+            node.indent = indent
+        self.undo = []
+        self.undo_reused = []
         self.error_node = la
-        logging.debug ("\x1b[31mError\x1b[0m: %s %s %s", la, la.prev_term, la.next_term)
-        logging.debug("loopcount: %s", self.loopcount)
+        if TRACE:
+            tracer.record("error", self, id(la), la.symbol.name, self.current_state, self.loopcount)
         return "Error"
 
-    def reduce(self, element):
+    def reduce(self, rule_id):
         """
         Execute the reduction given on the current stack.
 
@@ -317,91 +459,107 @@ class IncParser(object):
         added "silently" to the subtree (they don't count to the amount of
         symbols of the reduction)
 
-        :type element: Reduce
-        :param element: reduction to apply
+        :type rule_id: int
+        :param rule_id: index of the reduction in the compiled syntax table
         :except Exception rule not applicable
         """
+        element = self.syntaxtable.reductions[rule_id]
+        amount = self.syntaxtable.reduce_amounts[rule_id]
+        right = element.action.right
 
         #Fill a children array with nodes that are on the stack
-        children = []
-        i = 0
-        while i < element.amount():
-            c = self.stack.pop()
+        children = self.stack[len(self.stack)-amount:]
+        del self.stack[len(self.stack)-amount:]
+        for i in range(amount):
             # apply folding information from grammar to tree nodes
-            fold = element.action.right[element.amount()-i-1].folding
-            c.symbol.folding = fold
-            children.insert(0, c)
-            i += 1
+            children[i].symbol.folding = right[i].folding
 
-        logging.debug("   Element on stack: %s(%s)", self.stack[-1].symbol, self.stack[-1].state)
         self.current_state = self.stack[-1].state #XXX don't store on nodes, but on stack
-        logging.debug("   Reduce: set state to %s (%s)", self.current_state, self.stack[-1].symbol)
 
-        goto = self.syntaxtable.lookup(self.current_state, element.action.left)
-        if goto is None:
+        goto = self.syntaxtable.lookup_id(self.current_state, self.syntaxtable.reduce_gotos[rule_id])
+        if not goto:
             raise Exception("Reduction error on %s in state %s: goto is None" % (element, self.current_state))
-        assert goto != None
 
-        # save childrens parents state
+        new_node = self.find_reusable(element.action.left, children)
+        reused = new_node is not None
+        if reused:
+            # the reduction rebuilds a subtree of the previous version: keep
+            # its node, so the children don't have to change and be saved
+            old_indent = new_node.indent
+            self.undo_reused.append((new_node, new_node.changed, old_indent))
+            new_node.state = goto >> ACTION_BITS
+            new_node.first_term = None
+            new_node.indent = None
+        else:
+            # save childrens parents state. Only the values from before this
+            # parse are needed to roll it back, so each node is recorded the
+            # first time it is reduced, which is tracked by stamping it with
+            # the parse's generation
+            generation = self.generation
+            undo = self.undo
+            for c in children:
+                if c.generation != generation:
+                    c.generation = generation
+                    undo.append((c, c.parent, c.left, c.right, c.log.changes_count))
+                c.mark_version()
+            new_node = Node(element.action.left.copy(), goto >> ACTION_BITS, children)
         for c in children:
-            self.undo.append((c, 'parent', c.parent))
-            self.undo.append((c, 'left', c.left))
-            self.undo.append((c, 'right', c.right))
-            self.undo.append((c, 'log', c.log.copy()))
-            c.mark_version() # XXX with node reuse we only have to do this if the parent changes
-
-        new_node = Node(element.action.left.copy(), goto.action, children)
-        self.pm.do_incparse_reduce(new_node)
-        logging.debug("   Add %s to stack and goto state %s", new_node.symbol, new_node.state)
+            # remember leftmost terminal to speed up optimistic shifting
+            if not isinstance(c.symbol, Nonterminal):
+                new_node.first_term = c
+                break
+            if c.children:
+                if not c.changed:
+                    new_node.first_term = c.first_term
+                break
+        if self.pm.do_incparse_reduce:
+            self.pm.do_incparse_reduce(new_node)
+        if reused and new_node.indent != old_indent:
+            new_node.save_ns()
+        if TRACE:
+            tracer.record("reduce", self, id(new_node), new_node.symbol.name, rule_id, new_node.state, reused)
         self.stack.append(new_node)
         self.current_state = new_node.state # = goto.action
-        logging.debug("Reduce: set state to %s (%s)", self.current_state, new_node.symbol)
-        if getattr(element.action.annotation, "interpret", None):
-            # eco grammar annotations\
-            self.interpret_annotation(new_node, element.action)
-        else:
-            # johnstone annotations
-            self.add_alternate_version(new_node, element.action)
-
-    def interpret_annotation(self, node, production):
-        annotation = production.annotation
-        if annotation:
-            astnode = annotation.interpret(node)
-            node.alternate = astnode
-
-    def add_alternate_version(self, node, production):
-        # add alternate (folded) versions for nodes to the tree
-        alternate = TextNode(node.symbol.__class__(node.symbol.name), node.state, [])
-        alternate.children = []
-        teared = []
-        for i in range(len(node.children)):
-            if production.inserts.has_key(i):
-                # insert tiered nodes at right position
-                value = production.inserts[i]
-                for t in teared:
-                    if t.symbol.name == value.name:
-                        alternate.children.append(t)
-            c = node.children[i]
-            if c.symbol.folding == "^^^":
-                c.symbol.folding = None
-                teared.append(c)
+        if not reused or new_node.changed or not new_node.has_alternate():
+            # the alternate (AST or folded version) is only built when it's
+            # needed (see TextNode.alternate). Nodes that were kept and have
+            # nothing changed below them keep theirs, unless they were loaded
+            # from a file and have none yet
+            new_node.set_production(element.action)
+        new_node.changed = False
+
+    def find_reusable(self, symbol, children):
+        """
+        Return the node that was the parent of `children` in the previous
+        version if it still is a `symbol` with exactly these children, or
+        None. Empty nonterminals are created anew by every parse, so they
+        match any empty nonterminal with the same symbol, which is kept.
+
+        :param symbol: left hand side of the reduction
+        :param children: nodes the reduction takes from the stack
+        """
+        node = None
+        for c in children:
+            if c.children or not isinstance(c.symbol, Nonterminal):
+                node = c.parent
+                break
+        if node is None or node.deleted or node.symbol.name != symbol.name:
+            return None
+        old = node.children
+        if len(old) != len(children):
+            return None
+        for i in range(len(children)):
+            if old[i] is children[i]:
                 continue
-            elif c.symbol.folding == "^^":
-                while c.alternate is not None:
-                    c = c.alternate
-                alternate.symbol = c.symbol
-                for child in c.children:
-                    alternate.children.append(child)
-            elif c.symbol.folding == "^":
-                while c.alternate is not None:
-                    c = c.alternate
-                for child in c.children:
-                    alternate.children.append(child)
-            else:
-                alternate.children.append(c)
-        node.alternate = alternate
+            if old[i].children or children[i].children or old[i].symbol != children[i].symbol:
+                return None
+            if not isinstance(old[i].symbol, Nonterminal):
+                return None
+        return node
 
     def left_breakdown(self, la):
+        if TRACE:
+            tracer.record("breakdown", self, id(la), la.symbol.name)
         if len(la.children) > 0:
             return la.children[0]
         else:
@@ -413,7 +571,8 @@ class IncParser(object):
         # using the (correct) current state from before the optimistic shift of
         # it's parent tree
         self.current_state = self.stack[-1].state
-        logging.debug("right breakdown(%s): set state to %s", node.symbol.name, self.current_state)
+        if TRACE:
+            tracer.record("rbreakdown", self, id(node), node.symbol.name, self.current_state)
         while(isinstance(node.symbol, Nonterminal)):
             for c in node.children:
                 self.shift(c, rb=True)
@@ -429,25 +588,26 @@ class IncParser(object):
                 self.stack.append(node)
                 return
             else:
-                logging.debug("right breakdown else: set state to %s", self.stack[-1].state)
                 self.current_state = self.stack[-1].state
         self.shift(node, rb=True) # pushes previously popped terminal back on stack
 
-    def shift(self, la, element=None, rb=False):
-        if not element:
-            lookup_symbol = self.get_lookup(la)
-            element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
-        logging.debug("\x1b[32m" + "%sShift(%s)" + "\x1b[0m" + ": %s -> %s", "rb" if rb else "", self.current_state, la, element)
-        la.state = element.action
+    def shift(self, la, state=None, rb=False):
+        if state is None:
+            lookup_id = self.get_lookup(la)
+            state = self.syntaxtable.lookup_id(self.current_state, lookup_id) >> ACTION_BITS
+        if TRACE:
+            tracer.record("shift", self, id(la), la.symbol.name, self.current_state, state, rb)
+        la.state = state
         self.stack.append(la)
-        self.current_state = la.state
+        self.current_state = state
 
         if not la.lookup == "<ws>":
             # last_shift_state is used to predict next symbol
             # whitespace destroys correct behaviour
-            self.last_shift_state = element.action
+            self.last_shift_state = state
 
-        self.pm.do_incparse_shift(la, rb)
+        if self.pm.do_incparse_shift:
+            self.pm.do_incparse_shift(la, rb)
 
     def pop_lookahead(self, la):
         """
@@ -456,14 +616,14 @@ class IncParser(object):
         :param la:
         :return:
         """
-        org = la
-        while(la.right_sibling() is None):
+        right = la.right_sibling()
+        while(right is None):
             la = la.parent
-        logging.debug("pop_lookahead(%s): %s", org.symbol, la.right_sibling().symbol)
-        return la.right_sibling()
+            right = la.right_sibling()
+        return right
 
     def shiftable(self, la):
-        if self.syntaxtable.lookup(self.current_state, la.symbol):
+        if self.syntaxtable.lookup_id(self.current_state, self.syntaxtable.symbol_id(la.symbol)):
             return True
         return False
 
@@ -486,11 +646,7 @@ class IncParser(object):
         return AST(root)
 
     def get_next_possible_symbols(self, state_id):
-        l = set()
-        for (state, symbol) in self.syntaxtable.table.keys():
-            if state == state_id:
-                l.add(symbol)
-        return l
+        return set(self.syntaxtable.get_symbols(state_id))
 
     def get_next_symbols_list(self, state = -1):
         if state == -1:
@@ -520,6 +676,7 @@ class IncParser(object):
         self.ast_stack = []
         self.all_changes = []
         self.undo = []
+        self.undo_reused = []
         self.last_shift_state = 0
         self.validating = False
         self.last_status = False
@@ -540,3 +697,7 @@ class IncParser(object):
     def save_status(self, version):
         self.status_by_version[version] = self.last_status
         self.errornode_by_version[version] = self.error_node
+
+    def forget_status(self, version):
+        self.status_by_version.pop(version, None)
+        self.errornode_by_version.pop(version, None)
@@ -0,0 +1,332 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+LALR(1) automaton construction following DeRemer and Pennello, "Efficient
+Computation of LALR(1) Look-Ahead Sets" (1982).
+
+The LR(0) automaton is built once. Lookaheads are then computed for every
+nonterminal transition from the `reads` and `includes` relations, and handed
+to the reductions via `lookback`. Items and terminal sets are plain integers
+(terminal sets are bitsets) while building, and converted into the StateSets
+used by the SyntaxTable at the end.
+"""
+
+from state import StateSet, LR0Element
+from production import Production
+from syntaxtable import FinishSymbol
+from grammar_parser.gparser import Nonterminal, Epsilon
+from time import time
+import logging
+
+def digraph(count, relation, base):
+    """
+    Compute F(x) = base(x) | union(F(y) for x R y) for all 0 <= x < count,
+    collapsing strongly connected components of `relation` on the way.
+    Iterative version of the DeRemer-Pennello `traverse` procedure.
+    """
+    infinity = count + 1
+    depth = [0] * count
+    result = list(base)
+    stack = []
+    for start in range(count):
+        if depth[start]:
+            continue
+        stack.append(start)
+        depth[start] = len(stack)
+        work = [(start, iter(relation[start]), len(stack))]
+        while work:
+            x, successors, d = work[-1]
+            for y in successors:
+                if depth[y] == 0:
+                    stack.append(y)
+                    depth[y] = len(stack)
+                    work.append((y, iter(relation[y]), len(stack)))
+                    break
+                if depth[y] < depth[x]:
+                    depth[x] = depth[y]
+                result[x] |= result[y]
+            else:
+                work.pop()
+                if depth[x] == d:
+                    while True:
+                        top = stack.pop()
+                        depth[top] = infinity
+                        result[top] = result[x]
+                        if top == x:
+                            break
+                if work:
+                    parent = work[-1][0]
+                    if depth[x] < depth[parent]:
+                        depth[parent] = depth[x]
+                    result[parent] |= result[x]
+    return result
+
+class LALRGraph(object):
+    """
+    Drop-in replacement for StateGraph (see lr_type LALR). Only reduce items
+    carry lookaheads in the resulting state sets.
+    """
+
+    def __init__(self, start_symbol, grammar, lr_type=None):
+        self.grammar = grammar
+        self.start_symbol = start_symbol
+        self.state_sets = []
+        self.edges = {}
+
+    def build(self):
+        start = time()
+        self.build_items()
+        self.build_lr0()
+        lookaheads = self.compute_lookaheads()
+        self.build_state_sets(lookaheads)
+        logging.info("states %s", len(self.state_sets))
+        logging.info("Finished building LALR Stategraph in %s", time() - start)
+
+    def build_items(self):
+        """Number all productions and LR(0) items of the grammar."""
+        self.productions = [Production(None, [self.start_symbol])]
+        self.bodies = [[self.start_symbol]]
+        self.by_symbol = {}
+        for symbol, rule in self.grammar.items():
+            ids = self.by_symbol.setdefault(symbol, [])
+            for i, a in enumerate(rule.alternatives):
+                # create epsilon symbol if alternative is empty
+                p = Production(symbol, a or [Epsilon()], rule.annotations[i], rule.precs[i])
+                if rule.inserts.has_key(i):
+                    insert = rule.inserts[i]
+                    p.inserts[insert[0]] = insert[1]
+                ids.append(len(self.productions))
+                self.productions.append(p)
+                self.bodies.append(a)
+
+        # item = item_base[production] + position of the dot
+        self.item_base = []
+        self.item_prod = []
+        self.item_next = []
+        for prod_id, body in enumerate(self.bodies):
+            self.item_base.append(len(self.item_prod))
+            for d in range(len(body) + 1):
+                self.item_prod.append(prod_id)
+                self.item_next.append(body[d] if d < len(body) else None)
+
+        self.nullable = set()
+        changed = True
+        while changed:
+            changed = False
+            for symbol, ids in self.by_symbol.items():
+                if symbol in self.nullable:
+                    continue
+                for prod_id in ids:
+                    if all(s in self.nullable for s in self.bodies[prod_id]):
+                        self.nullable.add(symbol)
+                        changed = True
+                        break
+
+        # items added to a closure by each nonterminal, including the items of
+        # nonterminals appearing leftmost in its alternatives
+        self.closure_items = {}
+        for symbol in self.by_symbol:
+            items = []
+            seen = set([symbol])
+            todo = [symbol]
+            while todo:
+                nt = todo.pop()
+                for prod_id in self.by_symbol.get(nt, []):
+                    items.append(self.item_base[prod_id])
+                    body = self.bodies[prod_id]
+                    if body and isinstance(body[0], Nonterminal) and body[0] not in seen:
+                        seen.add(body[0])
+                        todo.append(body[0])
+            self.closure_items[symbol] = items
+
+    def closure(self, kernel):
+        result = list(kernel)
+        added = set(kernel)
+        seen = set()
+        for item in kernel:
+            symbol = self.item_next[item]
+            if isinstance(symbol, Nonterminal) and symbol not in seen:
+                seen.add(symbol)
+                for i in self.closure_items.get(symbol, ()):
+                    if i not in added:
+                        added.add(i)
+                        result.append(i)
+        return result
+
+    def build_lr0(self):
+        self.kernels = []
+        self.closures = []
+        kernel_ids = {}
+        start_kernel = (self.item_base[0],)
+        kernel_ids[start_kernel] = 0
+        self.kernels.append(start_kernel)
+        i = 0
+        while i < len(self.kernels):
+            items = self.closure(self.kernels[i])
+            self.closures.append(items)
+            gotos = {}
+            order = []
+            for item in items:
+                symbol = self.item_next[item]
+                if symbol is None:
+                    continue
+                if symbol not in gotos:
+                    gotos[symbol] = []
+                    order.append(symbol)
+                gotos[symbol].append(item + 1)
+            for symbol in order:
+                kernel = tuple(sorted(set(gotos[symbol])))
+                _id = kernel_ids.get(kernel)
+                if _id is None:
+                    _id = len(self.kernels)
+                    kernel_ids[kernel] = _id
+                    self.kernels.append(kernel)
+                self.edges[(i, symbol)] = _id
+            i += 1
+
+    def compute_lookaheads(self):
+        """Return a dict mapping (state, production id) to a terminal bitset."""
+        edges = self.edges
+        terminal_bits = {}
+        def bit(symbol):
+            try:
+                return terminal_bits[symbol]
+            except KeyError:
+                b = terminal_bits[symbol] = 1 << len(terminal_bits)
+                return b
+
+        # number the nonterminal transitions
+        transitions = []
+        transition_ids = {}
+        outgoing = [[] for _ in self.kernels]
+        for (state, symbol), dest in edges.iteritems():
+            outgoing[state].append(symbol)
+            if isinstance(symbol, Nonterminal):
+                transition_ids[(state, symbol)] = len(transitions)
+                transitions.append((state, symbol))
+
+        # direct reads and reads relation
+        direct = []
+        reads = []
+        for state, symbol in transitions:
+            dest = edges[(state, symbol)]
+            dr = 0
+            rel = []
+            for s in outgoing[dest]:
+                if isinstance(s, Nonterminal):
+                    if s in self.nullable:
+                        rel.append(transition_ids[(dest, s)])
+                else:
+                    dr |= bit(s)
+            if state == 0 and symbol == self.start_symbol:
+                dr |= bit(FinishSymbol())
+            direct.append(dr)
+            reads.append(rel)
+        read = digraph(len(transitions), reads, direct)
+
+        # includes and lookback relations
+        includes = [[] for _ in transitions]
+        lookback = {}
+        for t, (state, symbol) in enumerate(transitions):
+            for prod_id in self.by_symbol.get(symbol, []):
+                body = self.bodies[prod_id]
+                q = state
+                path = []
+                for s in body:
+                    path.append(q)
+                    q = edges[(q, s)]
+                lookback.setdefault((q, prod_id), []).append(t)
+                for i in range(len(body) - 1, -1, -1):
+                    s = body[i]
+                    if isinstance(s, Nonterminal):
+                        includes[transition_ids[(path[i], s)]].append(t)
+                    if s not in self.nullable:
+                        break
+        follow = digraph(len(transitions), includes, read)
+
+        symbols = sorted(terminal_bits, key=terminal_bits.get)
+        cache = {}
+        def to_set(bits):
+            try:
+                return cache[bits]
+            except KeyError:
+                s = set()
+                i = 0
+                b = bits
+                while b:
+                    if b & 1:
+                        s.add(symbols[i])
+                    b >>= 1
+                    i += 1
+                cache[bits] = s
+                return s
+
+        result = {}
+        for key, ts in lookback.iteritems():
+            bits = 0
+            for t in ts:
+                bits |= follow[t]
+            result[key] = set(to_set(bits))
+        return result
+
+    def build_state_sets(self, lookaheads):
+        elements = {}
+        for i, items in enumerate(self.closures):
+            state_set = StateSet()
+            for item in items:
+                prod_id = self.item_prod[item]
+                p = self.productions[prod_id]
+                d = item - self.item_base[prod_id]
+                if not self.bodies[prod_id]:
+                    d = 1 # epsilon production
+                element = elements.get((prod_id, d))
+                if element is None:
+                    element = elements[(prod_id, d)] = LR0Element(p, d)
+                if self.item_next[item] is None:
+                    if prod_id == 0:
+                        la = set([FinishSymbol()])
+                    else:
+                        la = lookaheads.get((i, prod_id), set())
+                else:
+                    la = set()
+                state_set.add(element, la)
+            self.state_sets.append(state_set)
+        self.closures = None
+
+    def follow(self, from_id, symbol):
+        try:
+            return self.edges[(from_id, symbol)]
+        except KeyError:
+            return None
+
+    def get_symbols(self):
+        s = set()
+        for _, symbol in self.edges.keys():
+            s.add(symbol)
+        return s
+
+    def get_state_set(self, i):
+        return self.state_sets[i]
+
+    def convert_lalr(self):
+        # already LALR
+        pass
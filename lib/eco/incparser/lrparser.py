@@ -22,6 +22,7 @@
 from grammar_parser.gparser import Parser, Nonterminal, Terminal
 from syntaxtable import SyntaxTable, FinishSymbol, Reduce, Goto, Accept, Shift
 from stategraph import StateGraph
+from lalr import LALRGraph
 from constants import LR0, LALR
 from astree import AST, Node
 
@@ -31,11 +32,11 @@ class LRParser(object):
         parser = Parser(grammar)
         parser.parse()
 
-        self.graph = StateGraph(parser.start_symbol, parser.rules, lr_type)
-        self.graph.build()
-
         if lr_type == LALR:
-            self.graph.convert_lalr()
+            self.graph = LALRGraph(parser.start_symbol, parser.rules)
+        else:
+            self.graph = StateGraph(parser.start_symbol, parser.rules, lr_type)
+        self.graph.build()
 
         self.syntaxtable = SyntaxTable(lr_type)
         self.syntaxtable.build(self.graph)
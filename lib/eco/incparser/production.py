@@ -30,6 +30,8 @@ class Production(object):
         self.inserts = {}
 
     def __eq__(self, other):
+        if self is other:
+            return True
         return self.left == other.left and self.right == other.right
 
     def __hash__(self):
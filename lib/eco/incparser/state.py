@@ -24,6 +24,8 @@ from grammar_parser.gparser import Nonterminal
 
 class StateSet(object):
 
+    # set to True to measure the time spent on hashing state sets
+    profile = False
     _hashtime = 0
 
     def __init__(self, elements=None):
@@ -32,6 +34,7 @@ class StateSet(object):
         else:
             self.elements = set()
         self.lookaheads = {}
+        self._hash = None
 
     def __len__(self):
         return len(self.elements)
@@ -40,6 +43,7 @@ class StateSet(object):
         if element not in self.elements:
             self.elements.add(element)
             self.lookaheads[element] = lookahead
+            self._hash = None
 
     def get_lookahead(self, element):
         return self.lookaheads[element]
@@ -54,6 +58,7 @@ class StateSet(object):
                     a.lookahead |= b.lookahead
                     delete.add(b)
         self.elements.difference_update(delete)
+        self._hash = None
 
     def __contains__(self, element):
         return element in self.elements
@@ -86,8 +91,11 @@ class StateSet(object):
         return symbols
 
     def __eq__(self, other):
-        result = self.elements == other.elements
-        return result
+        if self is other:
+            return True
+        if self._hash is not None and other._hash is not None and self._hash != other._hash:
+            return False
+        return self.elements == other.elements
 
     def equals(self, other, with_lookahead=True):
         if with_lookahead:
@@ -124,13 +132,18 @@ class StateSet(object):
             print(str(e), self.lookaheads[e])
 
     def __hash__(self):
-        start = time()
-        _hash = 0
-        for element in self.elements:
-            _hash ^= hash(element)
-        end = time()
-        StateSet._hashtime += end-start
-        return _hash
+        # the elements of a state set don't change anymore once it has been
+        # added to a graph, so the hash only needs to be computed once
+        if self._hash is None:
+            if StateSet.profile:
+                start = time()
+            _hash = 0
+            for element in self.elements:
+                _hash ^= hash(element)
+            self._hash = _hash
+            if StateSet.profile:
+                StateSet._hashtime += time() - start
+        return self._hash
 
 class State(object):
 
@@ -182,6 +195,9 @@ class State(object):
     def clone(self):
         return State(self.p, self.d, self.b, self.k)
 
+    def advance(self):
+        return State(self.p, self.d + 1, self.b, self.k)
+
     def __repr__(self):
         return "State(%s, %s, %s, %s)" % (self.p, self.d, self.b, self.k)
 
@@ -209,15 +225,28 @@ class State(object):
         return self._hash
 
 class LR0Element(State):
+    """
+    An LR(0) item. Items are immutable: instead of cloning an item and moving
+    its dot, use `advance`, which returns the same item object every time.
+    """
 
     def __init__(self, production, pos):
         State.__init__(self, production, pos, None, None)
+        self._hash = hash(production) ^ hash(pos)
+        self._next = None
+
+    def advance(self):
+        if self._next is None:
+            self._next = LR0Element(self.p, self.d + 1)
+        return self._next
 
     def __eq__(self, other):
+        if self is other:
+            return True
         return self.p == other.p and self.d == other.d
 
     def __hash__(self):
-        return hash(self.p) ^ hash(self.d)
+        return self._hash
 
 class LR1Element(State):
 
@@ -63,7 +63,7 @@ class StateGraph(object):
             self.start_set.add(LR0Element(Production(None, [self.start_symbol]), 0), set([FinishSymbol()]))
 
     def build(self):
-        State._hashtime = 0
+        StateSet._hashtime = 0
         start = time()
         start_set = self.start_set
         closure = start_set
@@ -87,9 +87,7 @@ class StateGraph(object):
                 symbol = lrelement.next_symbol()
                 if not symbol: # state is final
                     continue
-                #XXX optimisation: create all configurations before building
-                new_element = lrelement.clone()
-                new_element.d += 1
+                new_element = lrelement.advance()
                 new_element_la = state_set.get_lookahead(lrelement)
                 stateset = new_gotos.setdefault(symbol, StateSet())
                 stateset.add(new_element, new_element_la)
@@ -110,7 +108,8 @@ class StateGraph(object):
         logging.info("closure time %s", self.closure_time)
         logging.info("closure time helper %s", self.helper.closure_time)
         logging.info("goto time %s", self.goto_time)
-        logging.info("hashtime %s", StateSet._hashtime)
+        if StateSet.profile:
+            logging.info("hashtime %s", StateSet._hashtime)
         logging.info("addcount %s", self.addcount)
         logging.info("states %s", len(self.state_sets))
         logging.info("weakly %s", self.weakly)
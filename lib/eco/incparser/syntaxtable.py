@@ -20,8 +20,21 @@
 # IN THE SOFTWARE.
 
 from production import Production
-from grammar_parser.gparser import Terminal, Nonterminal, Epsilon
+from grammar_parser.gparser import Terminal, Nonterminal, Epsilon, MagicTerminal
 from constants import LR0, LR1, LALR
+from array import array
+
+# Packed action codes used by the compiled table. The lowest bits store the
+# kind of action, the remaining bits its argument (the follow state for
+# shifts/gotos, the index into `SyntaxTable.reductions` for reductions). A
+# code of 0 means error.
+ERROR = 0
+SHIFT = 1
+GOTO = 2
+REDUCE = 3
+ACCEPT = 4
+ACTION_BITS = 3
+ACTION_MASK = (1 << ACTION_BITS) - 1
 
 class SyntaxTableElement(object):
 
@@ -71,6 +84,7 @@ class SyntaxTable(object):
     def __init__(self, lr_type=LR0):
         self.table = {}
         self.lr_type = lr_type
+        self.actions = None
 
     def build(self, graph, precedences=[]):
         start_production = Production(None, [graph.start_symbol])
@@ -111,6 +125,117 @@ class SyntaxTable(object):
                         self.table[(i, s)] = action
                     else:
                         del self.table[(i,s)]
+        self.compile()
+
+    def compile(self):
+        """
+        Compile the table into a flat integer array. Every symbol is interned
+        to a small integer (column), every state owns a row of `width` packed
+        action codes. Column 0 is reserved for unknown symbols and is always
+        an error.
+        """
+        self.symbols = [None]
+        self.symbol_ids = {}
+        self.reductions = []
+        self.reduce_amounts = []
+        self.reduce_gotos = []
+
+        states = 0
+        for (state, symbol) in self.table:
+            states = max(states, state + 1)
+            if symbol not in self.symbol_ids:
+                self.symbol_ids[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        self.restore_ids()
+
+        self.width = len(self.symbols)
+        self.actions = array('i', [ERROR]) * (states * self.width)
+        # states that can reduce on some lookahead. In all other states an
+        # unchanged nonterminal that can't be shifted via goto needs to be
+        # broken down without looking at its first terminal
+        self.reducing_states = bytearray(states)
+        reduction_ids = {}
+        for (state, symbol), element in self.table.iteritems():
+            code = self.encode(element, reduction_ids)
+            self.actions[state * self.width + self.symbol_ids[symbol]] = code
+            if code & ACTION_MASK == REDUCE:
+                self.reducing_states[state] = 1
+
+    def restore_ids(self):
+        """Rebuild the symbol to id mappings from the list of interned symbols."""
+        self.symbol_ids = {}
+        self.terminal_ids = {}
+        self.nonterminal_ids = {}
+        self.magic_ids = {}
+        for _id in range(1, len(self.symbols)):
+            symbol = self.symbols[_id]
+            self.symbol_ids[symbol] = _id
+            if isinstance(symbol, MagicTerminal):
+                self.magic_ids[symbol.name] = _id
+            elif isinstance(symbol, Terminal):
+                self.terminal_ids[symbol.name] = _id
+            elif isinstance(symbol, Nonterminal):
+                self.nonterminal_ids[symbol.name] = _id
+        self.eos_id = self.terminal_ids.get("<eos>", 0)
+        self.finish_id = self.symbol_ids.get(FinishSymbol(), 0)
+
+    def encode(self, element, reduction_ids):
+        if isinstance(element, Shift):
+            return (element.action << ACTION_BITS) | SHIFT
+        if isinstance(element, Goto):
+            return (element.action << ACTION_BITS) | GOTO
+        if isinstance(element, Accept):
+            return ACCEPT
+        if isinstance(element, Reduce):
+            # reductions of the same production share one index
+            try:
+                index = reduction_ids[element.action]
+            except KeyError:
+                index = len(self.reductions)
+                reduction_ids[element.action] = index
+                self.reductions.append(element)
+                self.reduce_amounts.append(element.amount())
+                self.reduce_gotos.append(self.symbol_ids.get(element.action.left, 0))
+            return (index << ACTION_BITS) | REDUCE
+        return ERROR
+
+    def symbol_id(self, symbol):
+        """
+        Return the integer id of `symbol` in the compiled table (0 if the
+        symbol is unknown). IndentationTerminals are looked up as normal
+        Terminals.
+        """
+        if isinstance(symbol, MagicTerminal):
+            return self.magic_ids.get(symbol.name, 0)
+        if isinstance(symbol, Terminal):
+            return self.terminal_ids.get(symbol.name, 0)
+        if isinstance(symbol, Nonterminal):
+            return self.nonterminal_ids.get(symbol.name, 0)
+        if isinstance(symbol, FinishSymbol):
+            return self.finish_id
+        return self.symbol_ids.get(symbol, 0)
+
+    def lookup_id(self, state_id, symbol_id):
+        """Return the packed action code for a state and an interned symbol."""
+        return self.actions[state_id * self.width + symbol_id]
+
+    def decode(self, code):
+        """Convert a packed action code back into a SyntaxTableElement."""
+        kind = code & ACTION_MASK
+        if kind == SHIFT:
+            return Shift(code >> ACTION_BITS)
+        if kind == GOTO:
+            return Goto(code >> ACTION_BITS)
+        if kind == REDUCE:
+            return self.reductions[code >> ACTION_BITS]
+        if kind == ACCEPT:
+            return Accept()
+        return None
+
+    def get_symbols(self, state_id):
+        """Return all symbols that have an action in the given state."""
+        row = state_id * self.width
+        return [self.symbols[i] for i in range(1, self.width) if self.actions[row + i]]
 
     def resolve_conflict(self, state, symbol, oldaction, newaction, precedences):
         # input: old_action, lookup_symbol, new_action
@@ -192,6 +317,11 @@ class SyntaxTable(object):
         return None
 
     def lookup(self, state_id, symbol):
+        if self.table is None:
+            # loaded from the table cache
+            if state_id * self.width >= len(self.actions):
+                return None
+            return self.decode(self.lookup_id(state_id, self.symbol_id(symbol)))
         try:
             return self.table[(state_id, symbol)]
         except KeyError:
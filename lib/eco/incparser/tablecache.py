@@ -0,0 +1,226 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Persistent cache for compiled syntax tables.
+
+Tables are stored in a flat binary file per grammar, named after a digest of
+everything the table depends on: the grammar itself, the parser type,
+whitespace handling, precedences and the source code of the table builder.
+A file consists of a fixed header, a small pickled section with the symbols
+and productions and the raw action arrays, which are read straight from a
+memory map.
+"""
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import os, sys, mmap, struct, tempfile, hashlib, logging
+from array import array
+
+from syntaxtable import SyntaxTable, Reduce
+
+# bump whenever the layout of the file or of the compiled table changes
+FORMAT_VERSION = 1
+MAGIC = "ECOTBL"
+EXTENSION = ".tbl"
+
+# magic, version, byteorder, lr_type, states, width, meta size, actions size,
+# reducing states size
+HEADER = struct.Struct("<6sIBIIIIII")
+
+# modules whose code influences the generated tables
+_builder_modules = ["incparser/constants.py", "incparser/helpers.py",
+                    "incparser/production.py", "incparser/state.py",
+                    "incparser/stategraph.py", "incparser/syntaxtable.py",
+                    "incparser/tablecache.py", "incparser/lalr.py",
+                    "grammar_parser/gparser.py",
+                    "grammar_parser/bootstrap.py"]
+_builder_digest = None
+
+def builder_digest():
+    """Digest of the table builder's source code, computed once per process."""
+    global _builder_digest
+    if _builder_digest is None:
+        h = hashlib.sha1(str(FORMAT_VERSION))
+        base = os.path.join(os.path.dirname(__file__), "..")
+        for name in _builder_modules:
+            try:
+                with open(os.path.join(base, name), "rb") as f:
+                    h.update(f.read())
+            except IOError:
+                h.update(name)
+        _builder_digest = h.hexdigest()
+    return _builder_digest
+
+def make_key(source, lr_type, whitespaces, precedences=None):
+    """
+    Create a stable cache key.
+
+    :param source: grammar text or a digest identifying the grammar (see EcoFile.digest)
+    """
+    h = hashlib.sha1()
+    h.update(builder_digest())
+    h.update("\0%s\0%s\0%s\0%r\0" % (source, lr_type, whitespaces, precedences or []))
+    return h.hexdigest()
+
+class TableCache(object):
+    """
+    Content addressed on-disk cache of SyntaxTables.
+
+    The cache directory defaults to $ECO_CACHE_DIR or lib/eco/pickle. Writes
+    are atomic and the cache is trimmed to `max_size` bytes by evicting the
+    least recently used tables.
+    """
+
+    def __init__(self, directory=None, max_size=256 * 1024 * 1024):
+        if directory is None:
+            directory = os.environ.get("ECO_CACHE_DIR", os.path.join(os.path.dirname(__file__), "..", "pickle"))
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key):
+        return os.path.join(self.directory, key + EXTENSION)
+
+    def load(self, key):
+        """Return the cached SyntaxTable for `key` or None."""
+        filename = self.path(key)
+        try:
+            f = open(filename, "rb")
+        except IOError:
+            return None
+        try:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                return None # empty file
+            try:
+                table = self.read_table(mm)
+            finally:
+                mm.close()
+        except Exception as e:
+            logging.warning("Ignoring broken table cache %s: %s", filename, e)
+            return None
+        finally:
+            f.close()
+        if table is not None:
+            try:
+                os.utime(filename, None) # mark as recently used
+            except OSError:
+                pass
+        return table
+
+    def store(self, key, table):
+        """Atomically write `table` to the cache."""
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmpname = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        except OSError as e:
+            logging.warning("Could not write table cache: %s", e)
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                self.write_table(f, table)
+            os.chmod(tmpname, 0644)
+            if os.name == "nt" and os.path.exists(self.path(key)):
+                os.remove(self.path(key))
+            os.rename(tmpname, self.path(key))
+        except (IOError, OSError) as e:
+            logging.warning("Could not write table cache: %s", e)
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used tables until the cache fits into max_size."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(EXTENSION):
+                continue
+            filename = os.path.join(self.directory, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, filename))
+            total += st.st_size
+        entries.sort()
+        # always keep the most recent table
+        for mtime, size, filename in entries[:-1]:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+                total -= size
+            except OSError:
+                pass
+
+    def write_table(self, f, table):
+        meta = pickle.dumps((table.symbols, [r.action for r in table.reductions],
+                             list(table.reduce_amounts), list(table.reduce_gotos)),
+                            pickle.HIGHEST_PROTOCOL)
+        actions = table.actions.tostring()
+        reducing = str(table.reducing_states)
+        states = len(table.reducing_states)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, sys.byteorder == "little",
+                            table.lr_type, states, table.width, len(meta),
+                            len(actions), len(reducing)))
+        f.write(meta)
+        f.write(actions)
+        f.write(reducing)
+
+    def read_table(self, mm):
+        (magic, version, little, lr_type, states, width, meta_size,
+         actions_size, reducing_size) = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            return None
+        if mm.size() != HEADER.size + meta_size + actions_size + reducing_size:
+            raise ValueError("truncated file")
+        pos = HEADER.size
+        symbols, productions, amounts, gotos = pickle.loads(mm[pos:pos + meta_size])
+        pos += meta_size
+        actions = array('i')
+        actions.fromstring(mm[pos:pos + actions_size])
+        if bool(little) != (sys.byteorder == "little"):
+            actions.byteswap()
+        pos += actions_size
+        reducing = bytearray(mm[pos:pos + reducing_size])
+
+        table = SyntaxTable(lr_type)
+        table.table = None # only the compiled table is available
+        table.symbols = symbols
+        table.restore_ids()
+        table.width = width
+        table.actions = actions
+        table.reducing_states = reducing
+        table.reductions = [Reduce(p) for p in productions]
+        table.reduce_amounts = amounts
+        table.reduce_gotos = gotos
+        return table
+
+cache = TableCache()
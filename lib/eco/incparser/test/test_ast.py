@@ -22,7 +22,7 @@
 from incparser.lrparser import LRParser
 from incparser.incparser import IncParser
 from incparser.constants import LR0, LR1, LALR
-from incparser.astree import AST, Node
+from incparser.astree import AST, Node, TextNode, History, Record
 from grammar_parser.gparser import Parser, Nonterminal, Terminal, Epsilon
 
 import pytest
@@ -54,6 +54,51 @@ def test_node():
     assert plus.right_sibling() is i2
     assert i2.right_sibling() is None
 
+def test_history():
+    a, b, c = [Record(TextNode(Terminal(x))) for x in "abc"]
+    h = History()
+    h.save(1, a)
+    h.save(3, b)
+    h.save(2, c)
+    assert h.versions == [1, 2, 3]
+    assert h.find(0) is None
+    assert h.find(2) is c
+    assert h.find(7) is b
+
+    h.mark(4)
+    h.mark(2)
+    h.mark(4)
+    assert h.changes == [2, 4]
+    assert h.has_changes(2)
+    assert not h.has_changes(3)
+    assert h.max_version() == 4
+
+    count = h.changes_count
+    h.mark(5)
+    h.changes_count = count
+    assert h.changes == [2, 4]
+
+    h.truncate(2)
+    assert h.versions == [1, 2]
+    assert h.changes == [2]
+    assert h.max_version() == 2
+
+def test_node_load():
+    a = TextNode(Terminal("a"))
+    b = TextNode(Terminal("b"))
+    parent = TextNode(Nonterminal("P"), 0, [a])
+    parent.save(1)
+    parent.set_children([a, b])
+    parent.save(3)
+
+    parent.load(2)
+    assert parent.children == [a]
+    assert parent.version == 1
+    assert parent.get_attr("children", 5) == (a, b)
+    assert parent.get_attr("symbol.name", 1) == "P"
+    with pytest.raises(AttributeError):
+        parent.get_attr("children", 0)
+
 def notest_ast():
     lrp = LRParser(grammar)
     lrp.check("1 + 2 * 3")
@@ -21,7 +21,7 @@
 
 from grammar_parser.gparser import Parser, Terminal, Nonterminal, Epsilon
 from incparser.syntaxtable import FinishSymbol
-from incparser.state import State, StateSet, LR1Element
+from incparser.state import State, StateSet, LR0Element, LR1Element
 from incparser.production import Production
 from incparser.helpers import follow, closure_0, goto_0, closure_1, Helper
 
@@ -172,12 +172,67 @@ def test_closure_1():
     assert LR1Element(Production(D, [d]), 0, set([a])) in closure
     assert LR1Element(Production(D, [epsilon]), 1, set([a])) in closure
 
+def test_closure_1_lookaheads():
+    s1 = StateSet()
+    s1.add(LR1Element(Production(F, [C, D, f]), 0), set([finish]))
+    closure = helper1.closure_1(s1)
+    assert closure.get_lookahead(LR1Element(Production(C, [D, A]), 0)) == set([d, f])
+    assert closure.get_lookahead(LR1Element(Production(D, [d]), 0)) == set([a])
+
+    # kernel elements that are part of their own closure
+    s2 = StateSet()
+    s2.add(LR1Element(Production(S, [S, b]), 0), set([c]))
+    s2.add(LR1Element(Production(A, [a]), 1), set([finish]))
+    closure = helper1.closure_1(s2)
+    assert len(closure.elements) == 4
+    assert closure.get_lookahead(LR1Element(Production(S, [S, b]), 0)) == set([b, c])
+    assert closure.get_lookahead(LR1Element(Production(S, [a]), 0)) == set([b])
+    assert closure.get_lookahead(LR1Element(Production(A, [a]), 1)) == set([finish])
+
+def test_closure_1_cached():
+    helper = Helper(r)
+    s1 = StateSet()
+    s1.add(LR1Element(Production(Z, [S]), 0), set([finish]))
+    closure = helper.closure_1(s1)
+    closure.add(LR1Element(Production(S, [a]), 1), set([b]))
+    assert len(helper.closure_1(s1).elements) == 4
+
+    # same kernel with different lookaheads
+    s2 = StateSet()
+    s2.add(LR1Element(Production(Z, [S]), 0), set([c]))
+    closure = helper.closure_1(s2)
+    assert closure.get_lookahead(LR1Element(Production(S, [a]), 0)) == set([b, c])
+    assert len(helper.closure_cache) == 2
+
 def test_goto_1():
     lre = LR1Element(Production(Z, [S]), 0, set([finish]))
     clone = lre.clone()
 
     assert lre == clone
 
+def test_advance():
+    helper = Helper(r)
+    s1 = StateSet()
+    s1.add(LR0Element(Production(Z, [S]), 0), set([finish]))
+    closure = helper.closure_1(s1)
+    items = [e for e in closure.elements if e.next_symbol() == S]
+    assert len(items) == 2
+    for e in items:
+        assert e.advance() is e.advance()
+        assert e.advance() == LR0Element(e.p, 1)
+        assert hash(e.advance()) == hash(LR0Element(e.p, 1))
+
+def test_stateset_hash():
+    s1 = StateSet()
+    s1.add(LR0Element(Production(Z, [S]), 0), set([finish]))
+    s2 = StateSet()
+    s2.add(LR0Element(Production(Z, [S]), 0), set([b]))
+    assert hash(s1) == hash(s2)
+    assert s1 == s2
+    s1.add(LR0Element(Production(Z, [S]), 1), set([finish]))
+    assert hash(s1) != hash(s2)
+    assert not s1 == s2
+
 def test_closure_recursion():
     pytest.skip("what is this supposed to test?")
     s1 = StateSet()
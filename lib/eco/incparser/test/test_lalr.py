@@ -0,0 +1,124 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from grammar_parser.gparser import Parser, Terminal, Nonterminal
+from incparser.lalr import LALRGraph, digraph
+from incparser.stategraph import StateGraph
+from incparser.syntaxtable import SyntaxTable, Shift, Goto, Reduce, FinishSymbol
+from incparser.constants import LR1, LALR
+
+def build(grammar, lr_type):
+    p = Parser(grammar)
+    p.parse()
+    if lr_type == LALR:
+        graph = LALRGraph(p.start_symbol, p.rules)
+    else:
+        graph = StateGraph(p.start_symbol, p.rules, lr_type)
+    graph.build()
+    st = SyntaxTable(lr_type)
+    st.build(graph)
+    return st
+
+def equivalent(t1, t2):
+    """Walk both automata in parallel and compare their actions."""
+    seen = set()
+    todo = [(0, 0)]
+    while todo:
+        s1, s2 = todo.pop()
+        if (s1, s2) in seen:
+            continue
+        seen.add((s1, s2))
+        symbols = set(t1.get_symbols(s1)) | set(t2.get_symbols(s2))
+        for symbol in symbols:
+            a1 = t1.lookup(s1, symbol)
+            a2 = t2.lookup(s2, symbol)
+            if type(a1) is not type(a2):
+                return False
+            if isinstance(a1, (Shift, Goto)):
+                todo.append((a1.action, a2.action))
+            elif isinstance(a1, Reduce) and repr(a1.action) != repr(a2.action):
+                return False
+    return True
+
+def test_digraph():
+    # 0 -> 1 -> 2 -> 1, 3 -> 0
+    relation = [[1], [2], [1], [0]]
+    result = digraph(4, relation, [1, 2, 4, 8])
+    assert result == [7, 6, 6, 15]
+
+def test_digraph_deep():
+    # long chains must not hit the recursion limit
+    n = 5000
+    relation = [[i + 1] for i in range(n - 1)] + [[]]
+    result = digraph(n, relation, [0] * (n - 1) + [1])
+    assert result == [1] * n
+
+def test_nullable():
+    grammar = """
+        S ::= "b" A "d"
+        A ::= "c"
+            |
+    """
+    assert equivalent(build(grammar, LR1), build(grammar, LALR))
+
+def test_lalr_lookaheads():
+    # not SLR(1): follow(R) contains "=" which would conflict in the state
+    # containing S ::= L . "=" R and R ::= L .
+    grammar = """
+        S ::= L "=" R
+            | R
+        L ::= "*" R
+            | "id"
+        R ::= L
+    """
+    st = build(grammar, LALR)
+    state = st.lookup(0, Nonterminal("L")).action
+    assert isinstance(st.lookup(state, Terminal("=")), Shift)
+    assert isinstance(st.lookup(state, FinishSymbol()), Reduce)
+    assert equivalent(build(grammar, LR1), st)
+
+def test_recursion():
+    grammar = """
+        E ::= E "+" T
+            | T
+        T ::= T "*" F
+            | F
+        F ::= "(" E ")"
+            | "a"
+            | L "x"
+        L ::= L "y"
+            |
+    """
+    assert equivalent(build(grammar, LR1), build(grammar, LALR))
+
+def test_ecofile_lr_type():
+    from grammars.grammars import EcoFile, calc
+    # eco files are built as LR1 unless LALR is asked for
+    parser, _ = calc.load()
+    assert parser.syntaxtable.lr_type == LR1
+    calc_lalr = EcoFile(calc.name, calc.filename, calc.base, lr_type=LALR)
+    parser, lexer = calc_lalr.load()
+    assert parser.syntaxtable.lr_type == LALR
+    # both are cached separately
+    parser, _ = calc_lalr.load()
+    assert parser.syntaxtable.lr_type == LALR
+    parser, _ = calc.load()
+    assert parser.syntaxtable.lr_type == LR1
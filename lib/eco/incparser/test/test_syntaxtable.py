@@ -68,3 +68,59 @@ def test_build():
     st.build(graph)
     for key in syntaxtable.keys():
         assert st.table[key] == syntaxtable[key]
+
+def test_compiled():
+    from incparser.syntaxtable import SHIFT, GOTO, REDUCE, ACCEPT, ACTION_BITS, ACTION_MASK
+    graph = StateGraph(p.start_symbol, p.rules, 1)
+    graph.build()
+    st = SyntaxTable(1)
+    st.build(graph)
+    for (state, symbol), element in st.table.items():
+        code = st.lookup_id(state, st.symbol_id(symbol))
+        kind, arg = code & ACTION_MASK, code >> ACTION_BITS
+        if isinstance(element, Shift):
+            assert (kind, arg) == (SHIFT, element.action)
+        elif isinstance(element, Goto):
+            assert (kind, arg) == (GOTO, element.action)
+        elif isinstance(element, Accept):
+            assert kind == ACCEPT
+        else:
+            assert kind == REDUCE
+            assert st.reductions[arg].action == element.action
+            assert st.symbols[st.reduce_gotos[arg]] == element.action.left
+    # unknown symbols are errors
+    assert st.lookup_id(0, st.symbol_id(Terminal("x"))) == 0
+    assert st.lookup_id(2, st.symbol_id(b)) == 0
+
+def test_reducing_states():
+    graph = StateGraph(p.start_symbol, p.rules, 1)
+    graph.build()
+    st = SyntaxTable(1)
+    st.build(graph)
+    for state in range(len(st.reducing_states)):
+        reduces = [e for (s, _), e in st.table.items() if s == state and isinstance(e, Reduce)]
+        assert bool(st.reducing_states[state]) == bool(reduces)
+
+def test_tablecache(tmpdir):
+    from incparser.tablecache import TableCache, make_key
+    graph = StateGraph(p.start_symbol, p.rules, 1)
+    graph.build()
+    st = SyntaxTable(1)
+    st.build(graph)
+    tc = TableCache(str(tmpdir))
+    key = make_key(grammar, 1, False)
+    assert tc.load(key) is None
+    tc.store(key, st)
+    loaded = tc.load(key)
+    assert loaded.table is None
+    assert list(loaded.actions) == list(st.actions)
+    assert loaded.reducing_states == st.reducing_states
+    for (state, symbol), element in st.table.items():
+        assert loaded.lookup(state, symbol) == element
+        assert symbol in loaded.get_symbols(state)
+    assert loaded.lookup(0, Terminal("x")) is None
+    # different settings use different keys
+    assert make_key(grammar, 1, True) != key
+    # broken files are ignored
+    open(tc.path(key), "w").write("ECOTBL")
+    assert tc.load(key) is None
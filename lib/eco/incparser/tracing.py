@@ -0,0 +1,80 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+"""
+Structured tracing of the incremental parser.
+
+Tracing is selected when the parser is loaded: if the environment variable
+ECO_TRACE is set, the parser records its steps (parses, shifts, optimistic
+shifts, reductions, breakdowns, accepts and errors) with their states and
+the ids of the nodes involved. Otherwise each step only tests the constant
+TRACE.
+
+The last ECO_TRACE_SIZE (default 100000) events are kept in a ring buffer,
+which is written as JSON to the file named by ECO_TRACE when Eco exits, or
+by calling tracer.dump.
+"""
+
+import os, time, json, atexit
+from collections import deque
+
+TRACE = bool(os.environ.get("ECO_TRACE"))
+
+# fields of each kind of event, following its time, kind and parser
+FIELDS = {
+    "parse":       ("generation", "reparse"),
+    "shift":       ("node", "symbol", "state", "goto", "rb"),
+    "optshift":    ("node", "symbol", "state", "goto"),
+    "reduce":      ("node", "symbol", "rule", "state", "reused"),
+    "breakdown":   ("node", "symbol"),
+    "rbreakdown":  ("node", "symbol", "state"),
+    "accept":      ("loopcount",),
+    "error":       ("node", "symbol", "state", "loopcount"),
+}
+
+class Tracer(object):
+
+    def __init__(self, size=100000):
+        self.events = deque(maxlen=size)
+
+    def record(self, kind, parser, *args):
+        self.events.append((time.time(), kind, id(parser)) + args)
+
+    def clear(self):
+        self.events.clear()
+
+    def to_json(self):
+        result = []
+        for event in self.events:
+            d = {"time": event[0], "event": event[1], "parser": event[2]}
+            d.update(zip(FIELDS[event[1]], event[3:]))
+            result.append(d)
+        return result
+
+    def dump(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_json(), f)
+
+tracer = Tracer(int(os.environ.get("ECO_TRACE_SIZE", 100000)))
+
+if TRACE:
+    atexit.register(lambda: tracer.dump(os.environ["ECO_TRACE"]))
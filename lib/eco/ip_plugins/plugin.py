@@ -1,33 +1,60 @@
-import pkgutil, importlib
+import os, pkgutil, importlib
+
+# Hooks that set up a plugin. They are called on every plugin that was loaded.
+SETUP_HOOKS = ["incparse_init", "incparse_from_dict"]
+
+# Hooks that are called while parsing. They are only called on the plugins
+# that apply to the parser (see PluginManager.update).
+PARSE_HOOKS = ["incparse_inc_parse_top", "incparse_bulk_load_top",
+               "incparse_optshift", "incparse_shift", "incparse_reduce"]
+
+_modules = None
+
+def plugin_modules():
+    """Return the plugin modules of this package. They are only searched for
+    once per process."""
+    global _modules
+    if _modules is None:
+        path = os.path.dirname(os.path.abspath(__file__))
+        names = [name for _, name, _ in pkgutil.iter_modules([path])]
+        names.remove("plugin")
+        _modules = [importlib.import_module("." + m, "ip_plugins") for m in names]
+    return _modules
+
+def fuse(funcs):
+    if not funcs:
+        return None
+    if len(funcs) == 1:
+        return funcs[0]
+    def func(*args):
+        for f in funcs:
+            f(*args)
+    return func
 
 class PluginManager:
+    """Calls the hooks of the plugins of a parser.
+
+    Each hook is resolved into the attribute do_<hook>: the plugin's method
+    if only one plugin implements it, a function calling all of them if more
+    do, or None if none does, which callers have to check for."""
 
     def __init__(self):
         self.loaded = []
+        self.update(None)
 
     def loadplugins(self, caller):
-        modules = [name for _, name, _ in pkgutil.iter_modules(['ip_plugins'])]
-        modules.remove("plugin")
-        for m in modules:
-            m = importlib.import_module("." + m, "ip_plugins")
+        for m in plugin_modules():
             p = m.load(caller)
             if p:
                 self.loaded.append(p)
+        self.update(caller)
 
-    def __getattr__(self, attr, *args, **kwargs):
-
-        funcs = []
-        if attr.startswith("do_"):
-            fname = attr[3:]
-            for p in self.loaded:
-                try:
-                    f = p.__getattribute__(fname)
-                    funcs.append(f)
-                except AttributeError:
-                    print("WARNING: Plugin %s has no method '%s'" % (type(p), fname))
-            def func(*args, **kwargs):
-                for f in funcs:
-                    f(*args, **kwargs)
-            return func
-        else:
-            return object.__getattribute__(self, attr)
+    def update(self, caller):
+        """Resolve the hooks again. Needs to be called when something changed
+        that decides whether a plugin applies to `caller`. A plugin applies
+        unless it has a method applies(caller) that returns False."""
+        applying = [p for p in self.loaded if not hasattr(p, "applies") or p.applies(caller)]
+        for hook in SETUP_HOOKS:
+            setattr(self, "do_" + hook, fuse([getattr(p, hook) for p in self.loaded if hasattr(p, hook)]))
+        for hook in PARSE_HOOKS:
+            setattr(self, "do_" + hook, fuse([getattr(p, hook) for p in applying if hasattr(p, hook)]))
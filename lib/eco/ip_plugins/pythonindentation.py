@@ -9,6 +9,10 @@ class PythonIndent(object):
         self.incparser = incparser
         self.multimode = None
 
+    def applies(self, incparser):
+        # see PluginManager.update
+        return incparser.indentation_based
+
     def incparse_init(self):
         self.comment_tokens = []
         self.indent_stack = None
@@ -40,9 +44,52 @@ class PythonIndent(object):
         elif isinstance(bos.next_term.symbol, IndentationTerminal):
             bos.next_term.parent.remove_child(bos.next_term)
 
+    def incparse_bulk_load_top(self):
+        """Insert the indentation tokens into the unparsed terminals of a new
+        file (see IncParser.bulk_load). This gives the same tokens and indent
+        levels as calling parse_whitespace while shifting each terminal, but
+        only visits every line once."""
+        if not self.incparser.indentation_based:
+            return
+        bos = self.incparser.previous_version.parent.children[0]
+        eos = self.incparser.previous_version.parent.children[-1]
+        last = eos.prev_term
+        if bos.next_term.lookup == "<ws>":
+            self.insert_terminals(bos, [Node(IndentationTerminal("INDENT"))])
+        indent = [0]
+        multimode = None
+        node = bos.next_term
+        while node is not eos:
+            next_term = node.next_term
+            if node.lookup == "MLS":
+                multimode = None if multimode else "MLS"
+            if not multimode and (node.lookup == "<return>" or node is last):
+                if node is last or self.is_logical_line(node):
+                    if next_term.lookup == "<ws>":
+                        ws = len(next_term.symbol.name)
+                    else:
+                        ws = 0
+                    needed, newindent = self.get_indentation_tokens_and_indent(indent, ws)
+                    if node is not last:
+                        node.indent = newindent
+                        indent = newindent
+                    self.insert_terminals(node, needed)
+            node = next_term
+
+    def insert_terminals(self, node, new):
+        """Link new terminals into the next_term chain after node, before
+        they have been added to the tree."""
+        last = node.next_term
+        for n in new:
+            n.prev_term = node
+            node.next_term = n
+            node = n
+        node.next_term = last
+        last.prev_term = node
+
     def incparse_optshift(self, la):
         if la.indent:
-            self.last_indent = list(la.indent)
+            self.last_indent = la.indent
 
     def incparse_shift(self, la, rb):
         self.toggle_multimode(la)
@@ -64,7 +111,7 @@ class PythonIndent(object):
                     n.parent.remove_child(n)
                     n = n.next_term
                 n.indent = None
-                self.update_succeeding_lines(n, self.last_indent[-1], list(self.last_indent))
+                self.update_succeeding_lines(n, self.last_indent)
 
     def incparse_from_dict(self, rules):
         if not rules:
@@ -82,23 +129,6 @@ class PythonIndent(object):
             self.multinewlines = []
         elif la.lookup == "MLS" and not self.multimode: self.multimode = "MLS"
 
-    def get_previous_ws(self, node):
-        """Returns the whitespace of the previous logical line"""
-        node = node.prev_term
-        while True:
-            if isinstance(node, BOS):
-                return 0
-            if node.lookup != "<return>":
-                node = node.prev_term
-                continue
-            if not self.is_logical_line(node):
-                node = node.prev_term
-                continue
-            if node.next_term.lookup == "<ws>":
-                return len(node.next_term.symbol.name)
-            else:
-                return 0
-
     def indents_differ(self, this, other):
         if len(this) != len(other):
             return True
@@ -183,8 +213,7 @@ class PythonIndent(object):
                     n.parent.remove_child(n)
                     n = n.next_term
                 la.indent = None
-                newindent = list(self.get_last_indent(la))
-                ws = self.get_previous_ws(la)
+                newindent = self.get_last_indent(la)
             else:
                 there = []
                 n = la.next_term
@@ -197,24 +226,28 @@ class PythonIndent(object):
                 else:
                     ws = 0
 
-                last_indent = list(self.get_last_indent(la))
-                needed, newindent = self.get_indentation_tokens_and_indent(last_indent, ws)
+                needed, newindent = self.get_indentation_tokens_and_indent(self.get_last_indent(la), ws)
                 indent_stack_eq = newindent == la.indent
                 if la is not self.last_token_before_eos:
-                    la.indent = list(newindent)
-                    self.last_indent = list(la.indent)
+                    la.indent = newindent
+                    self.last_indent = newindent
 
                 if self.indents_differ(there, needed):
                     self.repair_indents(la, there, needed)
                 elif indent_stack_eq:
                     return
-            self.update_succeeding_lines(la, ws, newindent)
-
-    def update_succeeding_lines(self, la, ws, newindent):
-        # update succeeding lines
-        # XXX this causes a chain reaction iterating over some lines
-        # multiple times. we might only have to do this for the <return>
-        # that has actually changed during the parse
+                if la is self.last_token_before_eos:
+                    # only eos follows, so there are no lines to update
+                    return
+            self.update_succeeding_lines(la, newindent)
+
+    def update_succeeding_lines(self, la, newindent):
+        """Mark the following lines whose indentation tokens or indent stack
+        don't match anymore, so the parser goes down their trees to update
+        them. The stack of each line is computed from the one of the line
+        before, starting with `newindent`. Once a line's tokens and stack are
+        unchanged, so are those of all lines after it and the walk stops."""
+        indent = newindent
         next_r = la.next_term
         while True:
             if isinstance(next_r, EOS):
@@ -225,65 +258,65 @@ class PythonIndent(object):
                 while isinstance(d.symbol, IndentationTerminal):
                     eos_there.insert(0, d)
                     d = d.prev_term
-                eos_needed, _ = self.get_indentation_tokens_and_indent(list(self.get_last_indent(d)), 0)
-                if self.indents_differ(eos_there, eos_needed):
+                eos_needed, _ = self.get_indentation(indent, 0)
+                if not self.tokens_match(eos_there, eos_needed):
                     self.last_token_before_eos.mark_changed() # don't repair here, only mark and repair just before last token is parsed
                 break
             if next_r.lookup != "<return>":
                 next_r = next_r.next_term
                 continue
 
-            # XXX need to skip unlogical lines (what if don't know if unlogical yet)
-
-            # if tokens need to be updated, mark as changed, so the parser will go down this tree to update
             next_ws = self.get_whitespace(next_r)
             if next_ws is None:
                 next_r = next_r.next_term
                 continue
-            needed, newindent = self.get_indentation_tokens_and_indent(newindent, next_ws)
-            if not self.indents_match(next_r, needed) or next_r.indent != newindent:
-                next_r.mark_changed()
-            if next_ws < ws:
-                # if newline has smaller whitespace -> mark and break
+            needed, indent = self.get_indentation(indent, next_ws)
+            if next_r.indent == indent and self.indents_match(next_r, needed):
                 break
-
+            # if tokens need to be updated, mark as changed, so the parser will go down this tree to update
+            next_r.mark_changed()
             next_r = next_r.next_term
 
-    def get_indentation_tokens_and_indent(self, indent, ws):
-        needed = []
-        newindent = []
+    def get_indentation(self, indent, ws):
+        """Return the names of the indentation tokens needed by a line with
+        `ws` whitespace after a line with the indent stack `indent`, and the
+        line's own stack. Stacks are never changed in place, so lines share
+        them where they are equal."""
         if ws > indent[-1]:
-            needed.append(Node(IndentationTerminal("NEWLINE")))
-            needed.append(Node(IndentationTerminal("INDENT")))
-            newindent = indent + [ws]
-        elif ws < indent[-1]:
-            needed.append(Node(IndentationTerminal("NEWLINE")))
-            while ws < indent[-1]:
-                indent.pop()
-                needed.append(Node(IndentationTerminal("DEDENT")))
-            newindent = list(indent)
-            if ws != indent[-1]:
-                # XXX in future, just ERROR here
-                needed.append(Node(IndentationTerminal("UNBALANCED")))
-        else:
-            needed.append(Node(IndentationTerminal("NEWLINE")))
-            newindent = list(indent)
+            return ["NEWLINE", "INDENT"], indent + [ws]
+        if ws == indent[-1]:
+            return ["NEWLINE"], indent
+        needed = ["NEWLINE"]
+        i = len(indent)
+        while ws < indent[i-1]:
+            i -= 1
+            needed.append("DEDENT")
+        newindent = indent[:i]
+        if ws != newindent[-1]:
+            # XXX in future, just ERROR here
+            needed.append("UNBALANCED")
         return needed, newindent
 
-    def indents_match(self, node, needed):
-        there = []
-        n = node.next_term
-        while isinstance(n.symbol, IndentationTerminal):
-            there.append(n)
-            n = n.next_term
+    def get_indentation_tokens_and_indent(self, indent, ws):
+        needed, newindent = self.get_indentation(indent, ws)
+        return [Node(IndentationTerminal(name)) for name in needed], newindent
 
+    def tokens_match(self, there, needed):
         if len(there) != len(needed):
             return False
         for i in range(len(there)):
-            if there[i].symbol != needed[i].symbol:
+            if there[i].symbol.name != needed[i]:
                 return False
         return True
 
+    def indents_match(self, node, needed):
+        there = []
+        n = node.next_term
+        while isinstance(n.symbol, IndentationTerminal):
+            there.append(n)
+            n = n.next_term
+        return self.tokens_match(there, needed)
+
     def get_whitespace(self, node):
         if not self.is_logical_line(node):
             return None
@@ -310,7 +343,6 @@ class PythonIndent(object):
             node.indent = l
 
 def load(caller):
-    # XXX only load if incparser is indentation_based
     if type(caller).__name__ == "IncParser":
         return PythonIndent(caller)
     return None
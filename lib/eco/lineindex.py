@@ -0,0 +1,326 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+MAX_BLOCK = 64
+MIN_BLOCK = MAX_BLOCK / 4
+
+class LineBlock(object):
+    """
+    Node of a LineIndex. Leaf blocks contain lines, all other blocks contain
+    blocks. Every block knows the number of lines below it, the sum of their
+    heights and their maximal width.
+    """
+    __slots__ = ["parent", "children", "leaf", "count", "height", "width"]
+
+    def __init__(self, children, leaf):
+        self.parent = None
+        self.children = children
+        self.leaf = leaf
+        self.update()
+
+    def update(self):
+        children = self.children
+        if self.leaf:
+            for line in children:
+                line.block = self
+            self.count = len(children)
+            self.height = sum([line.height for line in children])
+        else:
+            for block in children:
+                block.parent = self
+            self.count = sum([block.count for block in children])
+            self.height = sum([block.height for block in children])
+        self.update_width()
+
+    def update_width(self):
+        if self.children:
+            self.width = max([c.width for c in self.children])
+        else:
+            self.width = 0
+
+    def change_height(self, delta):
+        block = self
+        while block is not None:
+            block.height += delta
+            block = block.parent
+
+    def change_width(self, old, new):
+        block = self
+        while block is not None:
+            width = block.width
+            if new > width:
+                block.width = new
+            elif old == width and new < old:
+                block.update_width()
+            if block.width == width:
+                break
+            block = block.parent
+
+    def change_count(self, delta):
+        block = self
+        while block is not None:
+            block.count += delta
+            block = block.parent
+
+class LineIndex(object):
+    """
+    Sequence of the lines in the editor.
+
+    The lines are kept in a B+-tree so that inserting and deleting lines,
+    looking up a line by its number and summing up line heights take
+    logarithmic time. Lines point back to the block containing them (see
+    treemanager.Line) which is used to update the heights and widths when
+    they change and to find a line's number.
+
+    All insertions and deletions are recorded until `take_changes` is called.
+    Instead of copies of the whole list, those changes are stored per version
+    and undone or redone to go back to another version.
+    """
+
+    def __init__(self, lines=()):
+        self.root = LineBlock([], True)
+        self.changes = []
+        self.finger = None # last leaf that was accessed and its first line
+        for line in lines:
+            self.append(line)
+
+    def __len__(self):
+        return self.root.count
+
+    def __iter__(self):
+        stack = [self.root]
+        while stack:
+            block = stack.pop()
+            if block.leaf:
+                for line in block.children:
+                    yield line
+            else:
+                stack.extend(reversed(block.children))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        leaf, j = self.find(i)
+        return leaf.children[j]
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            for j in reversed(xrange(*i.indices(len(self)))):
+                self.changes.append((j, self.delete(j), False))
+        else:
+            self.changes.append((i, self.delete(i), False))
+
+    def __repr__(self):
+        return "LineIndex(%s)" % (list(self),)
+
+    def insert(self, i, line):
+        if i < 0:
+            i = max(0, i + len(self))
+        i = min(i, len(self))
+        self.changes.append((i, line, True))
+        self.insert_line(i, line)
+
+    def append(self, line):
+        self.insert(len(self), line)
+
+    def index(self, line):
+        """Return the number of `line`."""
+        block = line.block
+        if block is None:
+            raise ValueError("%s is not in the index" % (line,))
+        i = block.children.index(line)
+        while block.parent is not None:
+            for sibling in block.parent.children:
+                if sibling is block:
+                    break
+                i += sibling.count
+            block = block.parent
+        return i
+
+    def find(self, i):
+        """Return the leaf containing line `i` and the line's position in
+        it."""
+        count = self.root.count
+        if i < 0:
+            i += count
+        if i < 0 or i >= count:
+            raise IndexError("line index out of range")
+        if self.finger is not None:
+            leaf, start = self.finger
+            if start <= i < start + leaf.count:
+                return leaf, i - start
+        block = self.root
+        start = 0
+        while not block.leaf:
+            for child in block.children:
+                if i < start + child.count:
+                    block = child
+                    break
+                start += child.count
+        self.finger = (block, start)
+        return block, i - start
+
+    def height_before(self, i):
+        """Return the sum of the heights of the lines before line `i`."""
+        if i >= len(self):
+            return self.root.height
+        block = self.root
+        height = 0
+        while not block.leaf:
+            for child in block.children:
+                if i < child.count:
+                    block = child
+                    break
+                i -= child.count
+                height += child.height
+        for line in block.children[:i]:
+            height += line.height
+        return height
+
+    def find_height(self, y):
+        """Return the number of the line that is shown in visual row `y` and
+        the visual row it starts in."""
+        if y >= self.root.height:
+            last = len(self) - 1
+            return last, self.height_before(last)
+        block = self.root
+        i = 0
+        height = 0
+        while not block.leaf:
+            for child in block.children:
+                if y < height + child.height:
+                    block = child
+                    break
+                height += child.height
+                i += child.count
+        for line in block.children:
+            if y < height + line.height:
+                break
+            height += line.height
+            i += 1
+        return i, height
+
+    @property
+    def height(self):
+        return self.root.height
+
+    @property
+    def width(self):
+        return self.root.width
+
+    # versioning
+
+    def take_changes(self):
+        """Return the changes made since the last call and forget them."""
+        changes = self.changes
+        self.changes = []
+        return changes
+
+    def undo_changes(self, changes):
+        for i, line, inserted in reversed(changes):
+            if inserted:
+                self.delete(i)
+            else:
+                self.insert_line(i, line)
+
+    def redo_changes(self, changes):
+        for i, line, inserted in changes:
+            if inserted:
+                self.insert_line(i, line)
+            else:
+                self.delete(i)
+
+    # tree maintenance
+
+    def insert_line(self, i, line):
+        self.finger = None
+        block = self.root
+        while not block.leaf:
+            for child in block.children:
+                if i <= child.count:
+                    block = child
+                    break
+                i -= child.count
+            else:
+                block = block.children[-1]
+                i = block.count
+        block.children.insert(i, line)
+        line.block = block
+        block.change_count(1)
+        block.change_height(line.height)
+        block.change_width(0, line.width)
+        if len(block.children) > MAX_BLOCK:
+            self.split(block)
+
+    def delete(self, i):
+        leaf, j = self.find(i)
+        self.finger = None
+        line = leaf.children.pop(j)
+        line.block = None
+        leaf.change_count(-1)
+        leaf.change_height(-line.height)
+        leaf.change_width(line.width, 0)
+        self.rebalance(leaf)
+        return line
+
+    def split(self, block):
+        half = len(block.children) / 2
+        new = LineBlock(block.children[half:], block.leaf)
+        del block.children[half:]
+        block.update()
+        parent = block.parent
+        if parent is None:
+            self.root = LineBlock([block, new], False)
+            return
+        parent.children.insert(parent.children.index(block) + 1, new)
+        new.parent = parent
+        if len(parent.children) > MAX_BLOCK:
+            self.split(parent)
+
+    def rebalance(self, block):
+        parent = block.parent
+        if parent is None:
+            if not block.leaf and len(block.children) == 1:
+                self.root = block.children[0]
+                self.root.parent = None
+            return
+        if len(block.children) >= MIN_BLOCK:
+            return
+        i = parent.children.index(block)
+        if i > 0:
+            left, right = parent.children[i-1], block
+        elif len(parent.children) > 1:
+            left, right = block, parent.children[1]
+        else:
+            self.rebalance(parent)
+            return
+        children = left.children + right.children
+        if len(children) <= MAX_BLOCK:
+            left.children = children
+            left.update()
+            parent.children.remove(right)
+            self.rebalance(parent)
+        else:
+            half = len(children) / 2
+            left.children = children[:half]
+            right.children = children[half:]
+            left.update()
+            right.update()
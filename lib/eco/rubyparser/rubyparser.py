@@ -93,20 +93,12 @@ class RubyParser(object):
         self.previous_version = AST(root)
 
     def _find_node(self, lineno, charno):
-        node = self.previous_version.parent.children[0]
-        current_line = 1
-        current_charno = 0
-        while True:
-            node = node.next_term
-            if isinstance(node, EOS):
-                return node
-            if node.lookup == "<return>":
-                current_line += 1
-                current_charno = 0
-                continue
-            current_charno += len(node.symbol.name)
-            if current_line == lineno and current_charno >= charno:
-                return node
+        ast = self.previous_version
+        pos = ast.find_line(lineno - 1) + max(charno - 1, 0)
+        node, _ = ast.find_offset(pos)
+        if node.lookup == "<return>" or pos >= ast.find_line(lineno):
+            return ast.parent.children[-1]
+        return node
 
     def inc_parse(self, line_indents = [], reparse=False):
         settings = QSettings("softdev", "Eco")
@@ -143,3 +135,6 @@ class RubyParser(object):
 
     def save_status(self, version):
         pass
+
+    def forget_status(self, version):
+        pass
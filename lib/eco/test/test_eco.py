@@ -639,6 +639,23 @@ class Test_Compare(Test_Helper):
         with pytest.raises(AssertionError):
             self.tree_compare(parser1.previous_version.parent, parser2.previous_version.parent)
 
+    def test_compare_import_reparse(self):
+        t1 = TreeManager()
+        parser1, lexer1 = python.load()
+        t1.add_parser(parser1, lexer1, python.name)
+        inputstring = "class Test:\r    def x():\r        \"\"\"a\r  b\"\"\"\r        pass\r\r    # c\r    y = 1\r"
+        t1.import_file(inputstring)
+        assert parser1.last_status == True
+
+        t2 = TreeManager()
+        parser2, lexer2 = python.load()
+        t2.add_parser(parser2, lexer2, python.name)
+        t2.import_file(inputstring)
+        parser2.reparse()
+        assert parser2.last_status == True
+
+        self.tree_compare(parser1.previous_version.parent, parser2.previous_version.parent)
+
 class Test_Python(Test_Helper):
     def setup_class(cls):
         parser, lexer = python.load()
@@ -1177,7 +1194,51 @@ def z():
     pass"""
         self.treemanager.import_file(inputstring)
         assert self.parser.last_status == True
-        
+
+    def test_reindent_stops_after_block(self):
+        self.reset()
+        self.treemanager.import_file("if a:\n    b = 1\n    c = 2\n" + "z = 1\n" * 1000)
+        plugin = self.parser.pm.loaded[0]
+        visited = []
+        get_whitespace = plugin.get_whitespace
+        def counting(node):
+            visited.append(node)
+            return get_whitespace(node)
+        plugin.get_whitespace = counting
+        try:
+            self.treemanager.cursor.line = 2
+            self.treemanager.cursor.move_to_x(0)
+            for i in range(4):
+                self.treemanager.key_delete()
+        finally:
+            del plugin.get_whitespace
+        assert self.parser.last_status == True
+        assert self.treemanager.export_as_text().startswith("if a:\n    b = 1\nc = 2\nz = 1\n")
+        node = self.treemanager.lines[2].node
+        assert node.next_term.symbol.name == "NEWLINE"
+        assert node.next_term.next_term.symbol.name == "DEDENT"
+        assert node.next_term.next_term.next_term.symbol.name == "c"
+        # only the lines up to the first unchanged one are looked at
+        assert len(visited) < 20
+
+    def test_reindent_after_multiline_string(self):
+        self.reset()
+        self.treemanager.import_file("class X:\n    def x():\n        s = 2\n        pass1\n    def x():\n        pass2\ndef z():\n    z")
+        self.treemanager.cursor.line = 4
+        self.treemanager.cursor.move_to_x(0)
+        self.treemanager.key_end()
+        for c in "\"\"\"":
+            self.treemanager.key_normal(c)
+        assert self.parser.last_status == False
+        # closing the string from above changes the indentation of the lines
+        # after it, which have to be updated
+        self.treemanager.cursor.line = 2
+        self.treemanager.cursor.move_to_x(12)
+        for c in "\"\"\"":
+            self.treemanager.key_normal(c)
+        assert self.parser.last_status == True
+        assert self.treemanager.export_as_text() == "class X:\n    def x():\n        s = \"\"\"2\n        pass1\n    def x():\"\"\"\n        pass2\ndef z():\n    z"
+
 
 class Test_NestedLboxWithIndentation():
     def setup_class(cls):
@@ -1391,6 +1452,17 @@ class Test_Java:
             self.treemanager.key_normal(c)
         assert self.parser.last_status == True
 
+    def test_plugin_hooks(self):
+        # the indentation plugin only applies to indentation based languages
+        assert self.parser.pm.do_incparse_shift is None
+        assert self.parser.pm.do_incparse_reduce is None
+        assert self.parser.pm.do_incparse_init is not None
+        parser, lexer = python.load()
+        assert parser.pm.do_incparse_shift is None
+        parser.indentation_based = True
+        assert parser.pm.do_incparse_shift is not None
+        assert parser.pm.do_incparse_reduce is not None
+
 class Test_Undo(Test_Python):
 
     def reset(self):
@@ -1434,6 +1506,285 @@ class Test_Undo(Test_Python):
         self.treemanager.key_shift_ctrl_z()
         self.compare("1+2")
 
+    def test_max_version(self):
+        self.reset()
+        self.type_save("x")
+        self.type_save("1")
+        self.type_save("2")
+        max_version = self.treemanager.get_max_version()
+        assert max_version == self.treemanager.version
+
+        self.treemanager.key_ctrl_z()
+        self.treemanager.key_ctrl_z()
+        assert self.treemanager.get_max_version() == max_version
+
+        self.treemanager.key_normal("3")
+        assert self.treemanager.get_max_version() == self.treemanager.version
+        assert self.treemanager.get_max_version() < max_version
+        self.compare("x3")
+
+    def test_saved_nodes(self):
+        self.reset()
+        text = "\n".join(["x%s = %s" % (i, i) for i in range(50)])
+        self.treemanager.import_file(text)
+        self.treemanager.undo_snapshot()
+        self.treemanager.key_end()
+        self.type_save("1")
+        # only the nodes changed by the last edit are saved
+        def count(node):
+            return 1 + sum([count(c) for c in node.children])
+        saved = self.treemanager.saved_nodes[self.treemanager.version]
+        assert 0 < len(saved) < count(self.parser.previous_version.parent) / 4
+        self.compare(text.replace("= 0", "= 01", 1))
+
+        self.treemanager.key_ctrl_z()
+        self.compare(text)
+        self.treemanager.key_shift_ctrl_z()
+        self.compare(text.replace("= 0", "= 01", 1))
+
+    def test_saved_nodes_edit_after_undo(self):
+        self.reset()
+        self.type_save("3")
+        self.type_save("*")
+        self.treemanager.key_backspace()
+        self.treemanager.undo_snapshot()
+        self.type_save(" ")
+        self.treemanager.key_ctrl_z()
+        self.treemanager.key_ctrl_z()
+        self.compare("3*")
+        # the nodes changed by the undone edits have to be saved again
+        self.type_save(" ")
+        self.type_save("+")
+        self.treemanager.key_ctrl_z()
+        self.compare("3* ")
+        self.type_save("+")
+        self.compare("3* +")
+        self.treemanager.key_ctrl_z()
+        self.compare("3* ")
+        self.treemanager.key_ctrl_z()
+        self.compare("3*")
+
+    def test_saved_nodes_two_documents(self):
+        t1 = TreeManager()
+        parser1, lexer1 = python.load()
+        t1.add_parser(parser1, lexer1, python.name)
+        t1.import_file("x = 1")
+        t2 = TreeManager()
+        parser2, lexer2 = python.load()
+        t2.add_parser(parser2, lexer2, python.name)
+        t2.import_file("y = 2")
+
+        # edit the first document without saving, then save the second one
+        t1.begin_transaction()
+        t1.key_end()
+        t1.key_normal("3")
+        t2.key_end()
+        t2.key_normal("4")
+        node1 = t1.cursor.node
+        assert node1.symbol.name == "13"
+        assert node1 not in t2.saved_nodes[t2.version]
+
+        t1.commit_transaction()
+        assert node1 in t1.saved_nodes[t1.version]
+        assert t1.export_as_text() == "x = 13"
+        assert t2.export_as_text() == "y = 24"
+        t1.key_ctrl_z()
+        assert t1.export_as_text() == "x = 1"
+        t2.key_ctrl_z()
+        assert t2.export_as_text() == "y = 2"
+
+    def test_saved_nodes_parser_of_other_document(self):
+        t1 = TreeManager()
+        parser1, lexer1 = python.load()
+        t1.add_parser(parser1, lexer1, python.name)
+        t1.import_file("x = 1")
+        t2 = TreeManager()
+        parser2, lexer2 = python.load()
+        t2.add_parser(parser2, lexer2, python.name)
+        t2.import_file("y = 2")
+
+        t1.begin_transaction()
+        t1.key_end()
+        t1.key_normal("3")
+        t2.key_end()
+        t2.key_normal("4")
+        assert not t2.journal
+        # relexing or parsing the first document changes its tree, not the
+        # second one's
+        node1 = t1.cursor.node
+        node1.symbol.name = "135"
+        t1.relex(node1)
+        assert not t2.journal
+        parser1.reparse()
+        assert not t2.journal
+        assert t1.journal
+
+        t1.commit_transaction()
+        t2.undo_snapshot()
+        assert t1.export_as_text() == "x = 135"
+        assert t2.export_as_text() == "y = 24"
+        t1.key_ctrl_z()
+        assert t1.export_as_text() == "x = 1"
+        t2.key_ctrl_z()
+        assert t2.export_as_text() == "y = 2"
+
+    def test_undo_journal(self):
+        self.reset()
+        self.treemanager.undo_journal.window = 2
+        self.treemanager.undo_journal.cache_size = 1
+        self.type_save("class")
+        self.type_save(" X:")
+        self.type_save("\r    ")
+        self.type_save("pass")
+        self.compare("class X:\n    pass")
+        assert self.treemanager.undo_journal.spilled > 0
+
+        self.treemanager.key_ctrl_z()
+        self.treemanager.key_ctrl_z()
+        self.treemanager.key_ctrl_z()
+        self.compare("class")
+        self.treemanager.key_shift_ctrl_z()
+        self.treemanager.key_shift_ctrl_z()
+        self.compare("class X:\n    ")
+
+        self.type_save("x")
+        self.compare("class X:\n    x")
+        self.treemanager.key_ctrl_z()
+        self.treemanager.key_ctrl_z()
+        self.compare("class X:")
+
+    def test_undo_journal_deepcopy(self):
+        import copy
+        from incparser.astree import Record
+        self.reset()
+        journal = self.treemanager.undo_journal
+        journal.window = 1
+        for c in "x = 1":
+            self.treemanager.key_normal(c)
+            self.treemanager.undo_snapshot()
+        refs = [(page, page.refs) for page in journal.pages]
+        assert refs
+        dp = copy.deepcopy(self.parser.previous_version.parent)
+        # the copy has its own records, the pages are left alone
+        assert [(page, page.refs) for page in journal.pages] == refs
+        nodes = [dp]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children)
+            for i in range(len(node.log.records)):
+                assert node.log.record_at(i).__class__ is Record
+                assert node.log.records[i].__class__ is Record
+
+    def test_undo_journal_truncate(self):
+        self.reset()
+        journal = self.treemanager.undo_journal
+        journal.window = 2
+        for c in "x = 1 + 2 + 3":
+            self.treemanager.key_normal(c)
+            self.treemanager.undo_snapshot()
+        count = len(journal.nodes)
+        assert [n for n in journal.nodes.itervalues() if n.symbol.name == "2"]
+        for i in range(8):
+            self.treemanager.key_ctrl_z()
+        self.compare("x = 1")
+        self.treemanager.key_normal("0")
+        # the nodes referenced only by the pages of the discarded versions
+        # are dropped together with the pages
+        assert len(journal.nodes) < count
+        assert not [n for n in journal.nodes.itervalues() if n.symbol.name == "2"]
+        self.compare("x = 10")
+        self.treemanager.key_ctrl_z()
+        self.compare("x = 1")
+        self.treemanager.key_ctrl_z()
+        self.compare("x = ")
+
+    def test_undo_journal_forget(self):
+        self.reset()
+        journal = self.treemanager.undo_journal
+        journal.window = 2
+        self.treemanager.max_undo_steps = 5
+        self.treemanager.compact_after = 5
+        self.type_save("x = 1")
+        sizes = []
+        for i in range(600):
+            if i % 3 == 2:
+                self.treemanager.key_backspace()
+            else:
+                self.treemanager.key_normal("+" if i % 2 else "2")
+            self.treemanager.undo_snapshot()
+            if i % 200 == 199:
+                sizes.append((len(journal.nodes), journal.size))
+        # forgotten versions drop their pages and nodes, and the file space
+        # they used is reclaimed, so the journal doesn't keep growing
+        nodes, size = sizes[0]
+        for n, s in sizes[1:]:
+            assert n < 2 * nodes
+            assert s < 2 * size
+        text = self.treemanager.export_as_text()
+        for i in range(4):
+            self.treemanager.key_ctrl_z()
+        for i in range(4):
+            self.treemanager.key_shift_ctrl_z()
+        self.compare(text)
+
+    def test_compact_history(self):
+        self.reset()
+        self.treemanager.compact_after = 1
+        self.treemanager.max_undo_steps = 2
+        for text in ["class", " X:", "\r    ", "pass"]:
+            for c in text:
+                self.treemanager.key_normal(c)
+            self.treemanager.undo_snapshot()
+        self.compare("class X:\n    pass")
+        assert self.treemanager.first_version > 1
+        assert len(self.treemanager.saved_nodes) < self.treemanager.version / 2
+
+        self.treemanager.key_ctrl_z()
+        self.compare("class X:\n    ")
+        self.treemanager.key_ctrl_z()
+        self.compare("class X:")
+        self.treemanager.key_ctrl_z()
+        self.compare("class")
+        self.treemanager.key_ctrl_z()
+        self.compare("class")
+
+        self.treemanager.key_shift_ctrl_z()
+        self.treemanager.key_shift_ctrl_z()
+        self.treemanager.key_shift_ctrl_z()
+        self.compare("class X:\n    pass")
+
+    def test_compact_history_snapshot_after_undo(self):
+        # the editor takes a snapshot after undo and redo too
+        self.reset()
+        self.treemanager.compact_after = 3
+        texts = [""]
+        for text in ["x1", "+2", "+3", "+4"]:
+            for c in text:
+                self.treemanager.key_normal(c)
+            self.treemanager.undo_snapshot()
+            texts.append(texts[-1] + text)
+        self.treemanager.key_ctrl_z()
+        self.treemanager.key_ctrl_z()
+        self.treemanager.undo_snapshot()
+        self.compare(texts[2])
+        self.treemanager.key_shift_ctrl_z()
+        self.treemanager.key_shift_ctrl_z()
+        self.treemanager.undo_snapshot()
+        self.compare(texts[4])
+        for text in ["+5", "+6", "+7", "+8", "+9"]:
+            for c in text:
+                self.treemanager.key_normal(c)
+            self.treemanager.undo_snapshot()
+            texts.append(texts[-1] + text)
+        self.compare(texts[-1])
+
+        for text in reversed(texts[:-1]):
+            self.treemanager.key_ctrl_z()
+            self.compare(text)
+        for text in texts[1:]:
+            self.treemanager.key_shift_ctrl_z()
+            self.compare(text)
+
     def test_undo_indentation(self):
         self.reset()
         self.type_save("class")
@@ -2638,3 +2989,351 @@ y = 13""":
         self.treemanager.key_normal("#")
         assert self.parser.last_status == True
         
+
+class Test_LineIndex:
+    def test_random(self):
+        import random
+        from treemanager import Line
+        from lineindex import LineIndex
+        random.seed(0)
+        lines = LineIndex()
+        expected = []
+        for i in range(3000):
+            if expected and random.random() < 0.4:
+                j = random.randint(0, len(expected) - 1)
+                del lines[j]
+                del expected[j]
+            else:
+                j = random.randint(0, len(expected))
+                line = Line(None, random.randint(1, 3))
+                line.width = random.randint(0, 80)
+                lines.insert(j, line)
+                expected.insert(j, line)
+        assert list(lines) == expected
+        assert [lines[i] for i in range(len(expected))] == expected
+        assert lines.height == sum([l.height for l in expected])
+        assert lines.width == max([l.width for l in expected])
+
+        for i in range(0, len(expected), 17):
+            assert lines.index(expected[i]) == i
+            y = sum([l.height for l in expected[:i]])
+            assert lines.height_before(i) == y
+            assert lines.find_height(y) == (i, y)
+            assert lines.find_height(y + expected[i].height - 1) == (i, y)
+
+        widest = max(expected, key=lambda l: l.width)
+        widest.width = 0
+        expected[0].height = 10
+        assert lines.width == max([l.width for l in expected])
+        assert lines.height == sum([l.height for l in expected])
+
+    def test_changes(self):
+        from treemanager import Line
+        from lineindex import LineIndex
+        a, b, c, d = [Line(None) for i in range(4)]
+        lines = LineIndex([a, b])
+        lines.take_changes()
+        lines.insert(1, c)
+        del lines[0]
+        lines.append(d)
+        changes = lines.take_changes()
+        assert list(lines) == [c, b, d]
+        lines.undo_changes(changes)
+        assert list(lines) == [a, b]
+        lines.redo_changes(changes)
+        assert list(lines) == [c, b, d]
+
+class Test_TextOffsets(Test_Python):
+
+    def check_offsets(self):
+        text = self.treemanager.export_as_text()
+        assert self.ast.parent.text_length() == len(text)
+        offset = 0
+        node = self.ast.get_bos()
+        while not isinstance(node, EOS):
+            assert node.text_offset() == offset
+            length = node.text_length()
+            if length:
+                assert self.ast.find_offset(offset) == (node, 0)
+                assert self.ast.find_offset(offset + length - 1) == (node, length - 1)
+            offset += length
+            node = node.next_term
+        assert offset == len(text)
+        start = 0
+        for i, line in enumerate(text.split("\n")):
+            assert self.ast.find_line(i) == start
+            start += len(line) + 1
+
+    def test_offsets(self):
+        self.reset()
+        self.ast = self.parser.previous_version
+        self.treemanager.import_file(programs.connect4)
+        self.check_offsets()
+        text = self.treemanager.export_as_text()
+        node, i = self.ast.find_position(2, 4)
+        assert node.text_offset() + i == text.index("\n", text.index("\n") + 1) + 5
+        assert isinstance(self.ast.find_offset(len(text))[0], EOS)
+
+        self.treemanager.cursor.line = 3
+        self.treemanager.cursor.move_to_x(4)
+        self.treemanager.key_normal("x")
+        self.treemanager.key_normal("\r")
+        self.treemanager.undo_snapshot()
+        self.treemanager.cursor.line = 10
+        self.treemanager.cursor.move_to_x(2)
+        self.treemanager.key_backspace()
+        self.check_offsets()
+        self.treemanager.key_ctrl_z()
+        self.check_offsets()
+        self.treemanager.key_ctrl_z()
+        self.check_offsets()
+        assert self.treemanager.export_as_text() == text
+
+class Test_Search(Test_Python):
+
+    def test_find_text(self):
+        self.reset()
+        self.treemanager.import_file("x = 1\r\rdef foo(a, b):\r    return a + b")
+        self.treemanager.cursor_reset()
+        self.treemanager.find_text("foo(a")
+        assert self.treemanager.copySelection() == "foo(a"
+        assert self.treemanager.cursor.line == 2
+        self.treemanager.find_text("\\d\\n\\ndef", True)
+        assert self.treemanager.copySelection() == "1\n\ndef"
+        assert self.treemanager.selection_start.line == 0
+        assert self.treemanager.selection_end.line == 2
+        self.treemanager.find_text("x =") # wraps around
+        assert self.treemanager.copySelection() == "x ="
+        assert self.treemanager.cursor.line == 0
+
+        result = self.treemanager.find_all("a")
+        assert len(result) == 2
+        node, pos, end, end_pos = result[1]
+        assert node is end and node.symbol.name == "a" and (pos, end_pos) == (0, 1)
+
+    def test_replace_all(self):
+        import re
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        text = self.treemanager.export_as_text()
+        version = self.treemanager.version
+        count = self.treemanager.replace_all("(\\w+)\\.(\\w+)\\(", "\\2_\\1(", True)
+        self.treemanager.undo_snapshot()
+        assert self.treemanager.version == version + 1
+        expected = re.sub("(\\w+)\\.(\\w+)\\(", "\\2_\\1(", text)
+        assert count == len(re.findall("(\\w+)\\.(\\w+)\\(", text))
+        assert self.treemanager.export_as_text() == expected
+        assert self.parser.last_status == True
+
+        count = self.treemanager.replace_all(":\n", ":\n\n")
+        assert self.treemanager.export_as_text() == expected.replace(":\n", ":\n\n")
+        assert len(self.treemanager.lines) == expected.replace(":\n", ":\n\n").count("\n") + 1
+
+        self.treemanager.key_ctrl_z()
+        assert self.treemanager.export_as_text() == expected
+        self.treemanager.key_ctrl_z()
+        assert self.treemanager.export_as_text() == text
+
+class Test_Transaction(Test_Python):
+
+    def test_transaction(self):
+        self.reset()
+        version = self.treemanager.version
+        logged = len(self.treemanager.input_log)
+        self.treemanager.begin_transaction()
+        for c in "def foo(a):\r    return ab":
+            self.treemanager.key_normal(c)
+        self.treemanager.key_backspace()
+        # saves are deferred until the commit too
+        self.treemanager.save_current_version()
+        self.treemanager.begin_transaction()
+        self.treemanager.key_normal("x")
+        self.treemanager.commit_transaction()
+        assert self.treemanager.version == version
+        self.treemanager.commit_transaction()
+        assert self.treemanager.version == version + 1
+        saves = [l for l in self.treemanager.input_log[logged:]
+                 if l == "self.save_current_version()"]
+        assert len(saves) == 1
+        assert self.parser.last_status == True
+        assert self.treemanager.export_as_text() == "def foo(a):\n    return ax"
+        assert len(self.treemanager.lines) == 2
+
+        self.treemanager.undo_snapshot()
+        self.treemanager.key_ctrl_z()
+        assert self.treemanager.export_as_text() == ""
+        self.treemanager.key_shift_ctrl_z()
+        assert self.treemanager.export_as_text() == "def foo(a):\n    return ax"
+
+    def test_inputlog(self):
+        self.reset()
+        for c in "def foo(a):\r    return a":
+            self.treemanager.key_normal(c)
+        log = "\n".join(self.treemanager.input_log)
+        text = self.treemanager.export_as_text()
+
+        # replaying handles each action on its own, like when it was logged
+        self.reset()
+        version = self.treemanager.version
+        self.treemanager.apply_inputlog(log)
+        assert self.treemanager.export_as_text() == text
+        assert self.treemanager.version > version + 1
+        assert self.parser.last_status == True
+
+        self.reset()
+        version = self.treemanager.version
+        self.treemanager.apply_inputlog(log, batched=True)
+        assert self.treemanager.export_as_text() == text
+        assert self.treemanager.version == version + 1
+        assert self.parser.last_status == True
+
+class Test_ParseRollback(Test_Python):
+
+    def check_tree(self):
+        node = self.treemanager.get_bos()
+        while node is not None:
+            assert [c for c in node.parent.children if c is node]
+            node = node.next_term
+
+    def test_rollback(self):
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        self.treemanager.cursor.line = 20
+        self.treemanager.cursor.move_to_x(8)
+        self.treemanager.key_normal("(")
+        assert self.parser.last_status == False
+        assert self.parser.undo == []
+        self.check_tree()
+        self.parser.reparse()
+        assert self.parser.last_status == False
+        self.check_tree()
+
+        self.treemanager.key_backspace()
+        assert self.parser.last_status == True
+        assert self.parser.undo == []
+        self.check_tree()
+        assert self.treemanager.export_as_text() == programs.connect4
+
+    def test_rollback_indentation(self):
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        self.treemanager.cursor.line = 43
+        self.treemanager.cursor.move_to_x(0)
+        self.treemanager.key_normal("x")
+        assert self.parser.last_status == False
+        self.treemanager.key_backspace()
+        assert self.parser.last_status == True
+        self.check_tree()
+
+class Test_NodeReuse(Test_Python):
+
+    def nonterminals(self):
+        result = []
+        stack = [self.treemanager.get_bos().parent]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                result.append(node)
+                stack.extend(node.children)
+        return result
+
+    def test_reparse(self):
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        before = self.nonterminals()
+        self.parser.reparse()
+        assert self.parser.last_status == True
+        after = self.nonterminals()
+        assert len(after) == len(before)
+        assert all(a is b for a, b in zip(before, after))
+
+    def test_edit(self):
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        node = self.treemanager.lines[50].node.next_term
+        parents = []
+        while node.parent is not None:
+            node = node.parent
+            parents.append(node)
+        self.treemanager.cursor.line = 16
+        self.treemanager.cursor.move_to_x(15)
+        self.treemanager.key_normal("x")
+        assert self.parser.last_status == True
+        # only the nodes around the edit are rebuilt
+        node = self.treemanager.lines[50].node.next_term
+        kept = 0
+        while node.parent is not None:
+            node = node.parent
+            kept += len([p for p in parents if p is node])
+        assert kept >= len(parents) - 5
+        self.treemanager.key_backspace()
+        assert self.treemanager.export_as_text() == programs.connect4
+
+class Test_LazyAlternates(Test_Python):
+
+    def test_build_on_demand(self):
+        self.reset()
+        self.treemanager.import_file("x = 1\n" * 2000)
+        assert self.parser.last_status == True
+        file_input = self.treemanager.get_bos().parent.children[1].children[1]
+        assert file_input.production is not None
+        ast = file_input.alternate
+        assert file_input.production is None
+        assert ast.symbol.name == "FileInput"
+        assert len(ast.get("stmts").children) == 2000
+        assert file_input.alternate is ast
+
+    def test_edit(self):
+        self.reset()
+        self.treemanager.import_file("x = 1\ny = 2\n")
+        file_input = self.treemanager.get_bos().parent.children[1].children[1]
+        ast = file_input.alternate
+        stmt = ast.get("stmts").children[1]
+        stmt_ast = stmt.alternate
+
+        self.treemanager.cursor.line = 0
+        self.treemanager.cursor.move_to_x(5)
+        self.treemanager.key_normal("+")
+        self.treemanager.key_normal("2")
+        assert self.parser.last_status == True
+        file_input = self.treemanager.get_bos().parent.children[1].children[1]
+        new_ast = file_input.alternate
+        assert new_ast is not ast
+        stmts = new_ast.get("stmts").children
+        assert len(stmts) == 2
+        assert stmts[0].children[0].alternate is not None
+        # the unchanged statement keeps its alternate
+        assert stmts[1] is stmt
+        assert stmt.alternate is stmt_ast
+
+class Test_Tracing(Test_Python):
+
+    def test_trace(self):
+        from incparser import incparser, tracing
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        tracing.tracer.clear()
+        incparser.TRACE = True
+        try:
+            self.parser.reparse()
+        finally:
+            incparser.TRACE = tracing.TRACE
+        events = tracing.tracer.to_json()
+        tracing.tracer.clear()
+        assert events[0]["event"] == "parse"
+        assert events[0]["reparse"] == True
+        assert events[-1]["event"] == "accept"
+        startrule = self.treemanager.get_bos().parent.children[1]
+        assert events[-2]["event"] == "reduce"
+        assert events[-2]["node"] == id(startrule)
+        assert events[-2]["symbol"] == "Startrule"
+        assert set(e["event"] for e in events) >= set(["parse", "breakdown", "reduce", "accept"])
+
+    def test_disabled(self):
+        from incparser import tracing
+        if tracing.TRACE:
+            pytest.skip("tracing is enabled by ECO_TRACE")
+        tracing.tracer.clear()
+        self.reset()
+        self.treemanager.key_normal("x")
+        assert len(tracing.tracer.events) == 0
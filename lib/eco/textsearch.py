@@ -0,0 +1,136 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import re
+
+from grammar_parser.gparser import Terminal
+
+CHUNK_SIZE = 4096
+
+def leaf_text(node):
+    if node.symbol.__class__ is not Terminal:
+        return ""
+    if node.symbol.name == "\r":
+        return "\n"
+    return node.symbol.name
+
+def subtree_text(node):
+    text = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        children = node.text_children()
+        if children:
+            stack.extend(reversed(children))
+        else:
+            text.append(leaf_text(node))
+    return "".join(text)
+
+class TextSearch(object):
+    """
+    Searches the text of the document in `ast`, including all language boxes.
+
+    The text is put together from chunks, which are the largest subtrees whose
+    text is at most `chunk_size` characters long. The texts of the chunks and
+    of the whole document are cached in the nodes and are reset together with
+    their cached lengths (see TextNode.text_length), so after an edit only the
+    chunks around it have to be rebuilt. Newlines are returned as "\\n".
+
+    Matches are offsets into that text, `locate` maps them back to nodes.
+    """
+
+    def __init__(self, ast, chunk_size=CHUNK_SIZE):
+        self.ast = ast
+        self.chunk_size = chunk_size
+
+    def text(self):
+        root = self.ast.parent
+        root.text_length()
+        if root.textcache is not None:
+            return root.textcache
+        chunks = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            children = node.text_children()
+            if not children:
+                chunks.append(leaf_text(node))
+            elif node.text_length() <= self.chunk_size:
+                if node.textcache is None:
+                    node.textcache = subtree_text(node)
+                chunks.append(node.textcache)
+            else:
+                stack.extend(reversed(children))
+        root.textcache = "".join(chunks)
+        return root.textcache
+
+    def compile(self, pattern, regex=False):
+        if not regex:
+            pattern = re.escape(pattern)
+        return re.compile(pattern, re.MULTILINE)
+
+    def find(self, pattern, start=0, regex=False):
+        """Return the first match at or after `start`, continuing from the
+        beginning of the text if there is none. Empty matches are ignored."""
+        text = self.text()
+        expr = self.compile(pattern, regex)
+        for m in expr.finditer(text, start):
+            if m.end() > m.start():
+                return m
+        for m in expr.finditer(text, 0, start):
+            if m.end() > m.start():
+                return m
+        return None
+
+    def find_all(self, pattern, regex=False):
+        expr = self.compile(pattern, regex)
+        return [m for m in expr.finditer(self.text()) if m.end() > m.start()]
+
+    def locate(self, offsets):
+        """Return the terminal containing each of the sorted `offsets`, the
+        offset inside the terminal and the number of the line it is in. All
+        offsets are found in a single walk that skips the subtrees before and
+        between them. Offsets past the end of the text are mapped to EOS."""
+        result = []
+        k = 0
+        offset = line = 0
+        stack = [self.ast.parent]
+        while stack and k < len(offsets):
+            node = stack.pop()
+            length = node.text_length()
+            if offset + length <= offsets[k]:
+                offset += length
+                line += node.newline_count()
+                continue
+            children = node.text_children()
+            if children:
+                stack.extend(reversed(children))
+                continue
+            while k < len(offsets) and offsets[k] < offset + length:
+                result.append((node, offsets[k] - offset, line))
+                k += 1
+            offset += length
+            line += node.newline_count()
+        eos = self.ast.parent.children[-1]
+        while k < len(offsets):
+            result.append((eos, 0, line))
+            k += 1
+        return result
@@ -33,8 +33,12 @@ from export.jruby_javascript import JRubyJavaScriptExporter
 from export.simple_language import SimpleLanguageExporter
 from export.cpython import CPythonExporter
 from utils import arrow_keys, KEY_UP, KEY_DOWN, KEY_LEFT, KEY_RIGHT
+from undojournal import UndoJournal
+from textsearch import TextSearch
+from lineindex import LineIndex
 
 import math
+from bisect import bisect_right
 
 class FontManager(object):
     def __init__(self):
@@ -56,10 +60,34 @@ class Line(object):
     """
     def __init__(self, node, height=1):
         self.node = node        # this lines newline node
-        self.height = height    # line height
-        self.width = 0          # line width
+        self._height = height   # line height
+        self._width = 0         # line width
         self.indent = 0         # line indentation
         self.ws = 0
+        self.block = None       # block of the LineIndex containing this line
+
+    def get_height(self):
+        return self._height
+
+    def set_height(self, height):
+        if height != self._height:
+            if self.block is not None:
+                self.block.change_height(height - self._height)
+            self._height = height
+
+    height = property(get_height, set_height)
+
+    def get_width(self):
+        return self._width
+
+    def set_width(self, width):
+        if width != self._width:
+            old = self._width
+            self._width = width
+            if self.block is not None:
+                self.block.change_width(old, width)
+
+    width = property(get_width, set_width)
 
     def __repr__(self):
         return "Line(%s, width=%s, height=%s)" % (self.node, self.width, self.height)
@@ -387,21 +415,34 @@ class TreeManager(object):
     The TreeManager keeps track of the tre TODO
     """
     version = 1
+    journal = None # journal of the active TreeManager (see activate)
 
     def __init__(self):
-        self.lines = []             # storage for line objects
+        self.lines = LineIndex()    # storage for line objects
         self.mainroot = None        # root node (main language)
         self.parsers = []           # stores all currently used parsers
         self.edit_rightnode = False # changes which node to select when inbetween two nodes
         self.changed = False
         self.last_search = ""
+        self.last_search_regex = False
         self.version = 1
-        TreeManager.version = 1
         self.last_saved_version = 1
         self.savenextparse = False
-        self.saved_lines = {}
+        self.saved_lines = {}       # changes made to the lines in each version
         self.saved_parsers = {}
+        self.saved_nodes = {}       # nodes saved in each version
+        self.journal = {}           # nodes changed since the last save
+        self.undo_journal = UndoJournal()
         self.undo_snapshots = []
+        self.max_version = 0        # highest version saved so far
+        self.first_version = 1      # oldest version undo can go back to
+        self.compacted = 1          # versions up to here have been compacted
+        self.compact_after = 100    # see compact_history
+        self.max_undo_steps = 1000
+        self.transaction = 0        # nesting depth of begin_transaction
+        self.dirty_roots = []       # roots to reparse when it is committed
+        self.pending_save = False
+        self.activate()
 
         self.tool_data_is_dirty = False
 
@@ -432,8 +473,18 @@ class TreeManager(object):
         return main_lang in self.langs_with_debugger
 
     def log_input(self, method, *args):
+        # every action on the document is logged before it changes anything
+        self.activate()
         self.input_log.append("self.%s(%s)" % (method, ", ".join(args)))
 
+    def activate(self):
+        """Make this the TreeManager whose tree is being changed. Nodes record
+        their changes in the journal of the active TreeManager (see
+        Node.save_ns), so documents can be edited in turns without mixing up
+        their changes."""
+        TreeManager.version = self.version
+        TreeManager.journal = self.journal
+
     def set_font_test(self, width, height):
         # only needed for testing
         self.fontht = height
@@ -480,13 +531,16 @@ class TreeManager(object):
                 return lang
 
     def add_parser(self, parser, lexer, language):
+        self.activate()
         analyser = self.load_analyser(language)
         if lexer.is_indentation_based():
             parser.indentation_based = True
         self.parsers.append((parser, lexer, language, analyser))
+        parser.treemanager = self
         parser.inc_parse()
         if len(self.parsers) == 1:
             self.lines.append(Line(parser.previous_version.parent.children[0]))
+            self.lines.take_changes()
             self.mainroot = parser.previous_version.parent
             self.cursor = Cursor(self.mainroot.children[0], 0, 0, self.lines)
             self.selection_start = self.cursor.copy()
@@ -661,56 +715,155 @@ class TreeManager(object):
     def find_next(self):
         self.log_input("find_next")
         if self.last_search != "":
-            self.find_text(self.last_search)
+            self.find_text(self.last_search, self.last_search_regex)
 
     def find_text_no_cursor(self, text, parent_name='funcdef'):
-        # FIXME - infinite loop!
-        temp = self.cursor.copy()
-        while True:
-            self.find_text(text)
-            if self.cursor.node.parent.symbol.name != parent_name:
-                continue
-            node = self.cursor.node
-            break
-        self.cursor = temp
-        return node
-
-    def find_text(self, text):
-        startnode = self.cursor.node
-        node = self.cursor.node.next_term
-        line = self.cursor.line
-        index = -1
-        while node is not self.cursor.node:
-            if node is startnode:
-                break
-            if isinstance(node.symbol, MagicTerminal):
-                node = node.symbol.ast.children[0]
-                continue
-            if isinstance(node, EOS):
-                root = node.get_root()
-                lbox = root.get_magicterminal()
-                if lbox:
-                    node = lbox.next_term
-                    continue
-                else:
-                    # start from beginning
-                    node = self.get_bos()
-                    line = 0
-            index = node.symbol.name.find(text)
-            if index > -1:
-                break
-
-            if node.symbol.name == "\r":
-                line += 1
-            node = node.next_term
-        if index > -1:
-            self.cursor.line = line
+        for node, _, _, _ in self.find_all(text):
+            if node.parent.symbol.name == parent_name:
+                return node
+        return None
+
+    def get_text_search(self):
+        return TextSearch(self.parsers[0][0].previous_version)
+
+    def find_text(self, text, regex=False):
+        """Select the next occurrence of `text` (or of the regular expression
+        `text`) after the cursor. Matches may span several nodes and language
+        boxes."""
+        search = self.get_text_search()
+        start = self.cursor.node.text_offset() + self.cursor.pos
+        m = search.find(text, start, regex)
+        if m is not None:
+            (node, pos, line), (end, end_pos, _) = search.locate([m.start(), m.end() - 1])
+            if pos == 0:
+                # selections start after the cursor's node
+                node = self.cursor.find_previous_visible(node)
+                pos = len(node.symbol.name)
             self.cursor.node = node
-            self.cursor.pos = index
+            self.cursor.pos = pos
+            self.cursor.line = line
             self.selection_start = self.cursor.copy()
-            self.cursor.pos += len(text)
+            self.cursor.node = end
+            self.cursor.pos = end_pos + 1
+            self.cursor.line = line + m.group().count("\n")
             self.selection_end = self.cursor.copy()
         self.last_search = text
+        self.last_search_regex = regex
+
+    def find_all(self, text, regex=False):
+        """Return the start node, the offset inside it, the end node and the
+        offset after the match inside it for all occurrences of `text`."""
+        search = self.get_text_search()
+        offsets = []
+        for m in search.find_all(text, regex):
+            offsets.append(m.start())
+            offsets.append(m.end() - 1)
+        found = search.locate(offsets)
+        result = []
+        for i in range(0, len(found), 2):
+            node, pos, _ = found[i]
+            end, end_pos, _ = found[i+1]
+            result.append((node, pos, end, end_pos + 1))
+        return result
+
+    def replace_all(self, text, replacement, regex=False):
+        """
+        Replace all occurrences of `text` with `replacement`. If `regex` is
+        set, `text` is a regular expression and `replacement` may refer to its
+        groups. All occurrences are changed in one go: the nodes are only
+        relexed around each of them and the document is reparsed and saved
+        once (see begin_transaction). Occurrences that cross the border of a
+        language box are left alone. Returns the number of replacements.
+        """
+        self.log_input("replace_all", repr(str(text)), repr(str(replacement)), repr(regex))
+        self.tool_data_is_dirty = True
+        search = self.get_text_search()
+        matches = search.find_all(text, regex)
+        offsets = []
+        for m in matches:
+            offsets.append(m.start())
+            offsets.append(m.end() - 1)
+        found = search.locate(offsets)
+        cursor = self.cursor.node.text_offset() + self.cursor.pos
+
+        # go backwards so that the nodes and lines found for the earlier
+        # matches stay valid
+        relex = []
+        lines = []
+        roots = []
+        count = 0
+        for i in reversed(range(len(matches))):
+            m = matches[i]
+            node, pos, line = found[2*i]
+            end, end_pos, _ = found[2*i+1]
+            nodes = [node]
+            while nodes[-1] is not end:
+                next = nodes[-1].next_term
+                if isinstance(next.symbol, MagicTerminal) or isinstance(next, EOS):
+                    break
+                nodes.append(next)
+            if nodes[-1] is not end:
+                continue
+            count += 1
+            if regex:
+                new = m.expand(replacement)
+            else:
+                new = replacement
+            new = new.replace("\r\n", "\r").replace("\n", "\r")
+
+            # the lines starting inside the match are gone, lines that are
+            # rescanned later move up
+            k = m.group().count("\n")
+            del self.lines[line+1:line+1+k]
+            lines = [l - k if l > line + k else l for l in lines if not line < l <= line + k]
+            if line not in lines:
+                lines.append(line)
+            for n in nodes[1:]:
+                n.parent.remove_child(n)
+            new_text = node.symbol.name[:pos] + new + end.symbol.name[end_pos+1:]
+            if new_text:
+                node.change_text(new_text)
+                if not relex or relex[-1] is not node:
+                    relex.append(node)
+            else:
+                relex.append(node.next_term)
+                node.parent.remove_child(node)
+            root = node.get_root()
+            if not [r for r in roots if r is root]:
+                roots.append(root)
+
+            if m.end() <= cursor:
+                cursor += len(new) - (m.end() - m.start())
+            elif m.start() < cursor:
+                cursor = m.start() + len(new)
+
+        if not roots:
+            return 0
+        self.begin_transaction()
+        for node in relex:
+            if not node.deleted:
+                self.relex(node)
+        for line in sorted(lines, reverse=True):
+            self.rescan_linebreaks(line)
+        for root in roots:
+            self.reparse(root)
+        self.commit_transaction()
+
+        search = self.get_text_search()
+        cursor = min(cursor, len(search.text()))
+        if cursor > 0:
+            node, pos, line = search.locate([cursor - 1])[0]
+            self.cursor.node = node
+            self.cursor.pos = pos + 1
+            self.cursor.line = line + (node.symbol.name == "\r")
+        else:
+            self.cursor.node = self.get_bos()
+            self.cursor.pos = 0
+            self.cursor.line = 0
+        self.selection_start = self.cursor.copy()
+        self.selection_end = self.cursor.copy()
+        self.changed = True
+        return count
 
     def jump_to_error(self, parser):
         bos = parser.previous_version.parent.children[0]
@@ -761,6 +914,7 @@ class TreeManager(object):
 
     def key_shift_ctrl_z(self):
         self.log_input("key_shift_ctrl_z")
+        self.flush_transaction()
         try:
             i = self.undo_snapshots.index(self.version)
             if i == len(self.undo_snapshots) - 1:
@@ -768,21 +922,22 @@ class TreeManager(object):
             undo_amount = self.undo_snapshots[i+1] - self.undo_snapshots[i]
         except ValueError:
             undo_amount = self.undo_snapshots[0] - self.version
-        for i in range(undo_amount):
-            self.version += 1
-            TreeManager.version = self.version
-            self.recover_version("redo")
-            self.cursor.load(self.version, self.lines)
+        if undo_amount <= 0:
+            return
+        old_version = self.version
+        self.version += undo_amount
+        TreeManager.version = self.version
+        self.recover_version("redo", old_version)
+        self.cursor.load(self.version, self.lines)
 
     def get_max_version(self):
-        root = self.get_bos().parent
-        maxversion = 0
-        for (key, version) in root.log.keys():
-            maxversion = max(maxversion, version)
-        return maxversion
+        """Return the highest version that has been saved and not been
+        cleaned since, i.e. the version redo can go back to."""
+        return self.max_version
 
     def key_ctrl_z(self):
         self.log_input("key_ctrl_z")
+        self.flush_transaction()
         if len(self.undo_snapshots) == 0 and self.get_max_version() > 1:
             self.undo_snapshots.append(self.version)
         if not self.undo_snapshots:
@@ -795,17 +950,19 @@ class TreeManager(object):
         except ValueError:
             return
         if i == 0:
-            undo_amount = self.version - 1
+            undo_amount = self.version - self.first_version
         else:
             undo_amount = self.undo_snapshots[i] - self.undo_snapshots[i-1]
-        for i in range(undo_amount):
-            self.version -= 1
-            TreeManager.version = self.version
-            self.recover_version("undo")
-            self.cursor.load(self.version, self.lines)
-
-    def recover_version(self, direction):
-        self.load_lines()
+        if undo_amount <= 0:
+            return
+        old_version = self.version
+        self.version -= undo_amount
+        TreeManager.version = self.version
+        self.recover_version("undo", old_version)
+        self.cursor.load(self.version, self.lines)
+
+    def recover_version(self, direction, old_version):
+        self.load_lines(direction, old_version)
         self.load_parsers()
         for l in self.parsers:
             parser = l[0]
@@ -817,33 +974,23 @@ class TreeManager(object):
             bos.load(self.version)
             eos = root.children[-1]
             eos.load(self.version)
-            node = self.pop_lookahead(bos)
-            while True:
-                if isinstance(node, EOS):
-                    break
-                prev_version = node.version
-                if direction == "undo":
-                    # recover old version if changes were made in that version
-                    if not node.has_changes(self.version):
-                        node = self.pop_lookahead(node)
-                        continue
-                elif direction == "redo":
-                    # recover newer version of node.version is smaller
-                    # however, if after reloading the version stays the same
-                    # we don't have to update the whole subtree
-                    if node.version < self.version:
-                        node.load(self.version)
-                        if node.version == prev_version:
-                            node = self.pop_lookahead(node)
-                            continue
-                node.load(self.version)
-                # continue with children
-                if len(node.children) > 0:
-                    node = node.children[0]
-                    continue
-                else:
-                    # skip subtree and continue otherwise
-                    node = self.pop_lookahead(node)
+        # only nodes that were saved between the old and the new version
+        # differ between the two
+        if direction == "undo":
+            versions = xrange(self.version + 1, old_version + 1)
+        else:
+            versions = xrange(old_version + 1, self.version + 1)
+        loaded = set()
+        for v in versions:
+            for node in self.saved_nodes.get(v, []):
+                if id(node) not in loaded:
+                    loaded.add(id(node))
+                    node.load(self.version)
+        # the nodes saved in the next version were marked as changed in this
+        # one. Left in place, those marks would stop mark_changed early when
+        # we edit from here, keeping the nodes above out of the journal
+        for node in self.saved_nodes.get(self.version + 1, []):
+            node.log.unmark(self.version)
 
     def pop_lookahead(self, la):
         while(la.right_sibling() is None):
@@ -852,13 +999,18 @@ class TreeManager(object):
 
     def clean_versions(self, version):
         # clean linenumbers
-        for key in self.saved_lines.keys():
-            if key > version:
-                del self.saved_lines[key]
+        for v in xrange(version + 1, self.max_version + 1):
+            self.saved_lines.pop(v, None)
         for key in self.saved_parsers.keys():
             if key > version:
                 del self.saved_parsers[key]
         self.cursor.clean_versions(version)
+        for v in xrange(version + 1, self.max_version + 1):
+            for node in self.saved_nodes.pop(v, []):
+                self.delete_versions_from(node, version)
+        self.max_version = min(self.max_version, version)
+        self.compacted = min(self.compacted, version)
+        self.undo_journal.truncate(version)
         for i in range(len(self.undo_snapshots)):
             if self.undo_snapshots[i] > version:
                 self.undo_snapshots = self.undo_snapshots[:i]
@@ -867,61 +1019,25 @@ class TreeManager(object):
         for l in self.parsers:
             p = l[0]
             root = p.previous_version.parent
-            bos = root.children[0]
-            self.delete_versions_from(bos, version)
             self.delete_versions_from(root, version)
-            node = self.pop_lookahead(root.children[0])
-            while True:
-                if isinstance(node, EOS):
-                    break
-                self.delete_versions_from(node, version)
-                if len(node.children) > 0:
-                    node = node.children[0]
-                    continue
-                else:
-                    node = self.pop_lookahead(node)
+            self.delete_versions_from(root.children[0], version)
+            self.delete_versions_from(root.children[-1], version)
 
     def delete_versions_from(self, node, version):
-        for (key, v) in node.log.keys():
-            if v > version:
-                del node.log[(key, v)]
+        node.log.truncate(version)
 
     def save_lines(self):
-        # check if lines have changed
-        lines = self.get_lines_from_version(self.version)
-        if len(lines) != len(self.lines):
-            self.saved_lines[self.version] = list(self.lines)
-            return
-
-        # check if nodes are different (e.g. we could delete and reinsert a line between saves)
-        for i in range(len(lines)):
-            if lines[i] is not self.lines[i]:
-                self.saved_lines[self.version] = list(self.lines)
-                return
-
-    def get_lines_from_version(self, version):
-        version = self.version
-        while True:
-            if version == -1:
-                return []
-            try:
-                l = self.saved_lines[version]
-                break
-            except KeyError:
-                version -= 1
-        return l
-
-    def load_lines(self):
-        version = self.version
-        while True:
-            if version == 0:
-                return
-            try:
-                l = self.saved_lines[version]
-                break
-            except KeyError:
-                version -= 1
-        self.lines = list(l) # copy, otherwise saved list will be mutated
+        changes = self.lines.take_changes()
+        if changes:
+            self.saved_lines.setdefault(self.version, []).extend(changes)
+
+    def load_lines(self, direction, old_version):
+        if direction == "undo":
+            for v in xrange(old_version, self.version, -1):
+                self.lines.undo_changes(self.saved_lines.get(v, []))
+        else:
+            for v in xrange(old_version + 1, self.version + 1):
+                self.lines.redo_changes(self.saved_lines.get(v, []))
 
     def save_parsers(self):
         self.saved_parsers[self.version] = list(self.parsers)
@@ -930,6 +1046,7 @@ class TreeManager(object):
         self.parsers = list(self.saved_parsers[self.version])
 
     def save(self):
+        self.max_version = max(self.max_version, self.version)
         self.save_lines()
         self.save_parsers()
         self.cursor.save(self.version)
@@ -942,17 +1059,89 @@ class TreeManager(object):
             bos.save(self.version)
             eos = root.children[-1]
             eos.save(self.version)
-            node = self.pop_lookahead(bos)
-            while True:
-                if isinstance(node, EOS):
-                    node.save(self.version)
-                    break
-                if node.has_changes():
-                    node.save(self.version)
-                    if len(node.children) > 0:
-                        node = node.children[0]
-                        continue
-                node = self.pop_lookahead(node)
+        # save all nodes that were changed since the last save, unless the
+        # parser reverted the change
+        nodes = [node for node in self.journal.itervalues() if node.has_changes()]
+        self.journal.clear()
+        for node in nodes:
+            node.save(self.version)
+        self.saved_nodes[self.version] = nodes
+        self.compact_history()
+        self.spill_versions()
+
+    def compact_history(self):
+        """Undo only goes back to undo snapshots, so the versions in between
+        are merged once they are more than `compact_after` versions old. If
+        there are more than `max_undo_steps` snapshots, the history before
+        the oldest ones is forgotten."""
+        snapshots = self.undo_snapshots
+        if self.max_undo_steps is not None and len(snapshots) > self.max_undo_steps:
+            k = len(snapshots) - self.max_undo_steps
+            if snapshots[k-1] < self.version:
+                self.forget_versions(snapshots[k-1])
+                del snapshots[:k]
+        limit = self.version - self.compact_after
+        i = bisect_right(snapshots, self.compacted)
+        while i < len(snapshots) and snapshots[i] <= limit:
+            self.compact_versions(self.compacted, snapshots[i])
+            self.compacted = snapshots[i]
+            i += 1
+
+    def compact_versions(self, start, end):
+        """Merge the versions after `start` up to `end` into `end`."""
+        nodes = {}
+        changes = []
+        for v in xrange(start + 1, end + 1):
+            for node in self.saved_nodes.pop(v, []):
+                nodes[id(node)] = node
+            for l in self.saved_parsers.get(v, []):
+                root = l[0].previous_version.parent
+                for node in [root, root.children[0], root.children[-1]]:
+                    nodes[id(node)] = node
+            changes.extend(self.saved_lines.pop(v, []))
+            if v < end:
+                self.forget_version(v)
+        for node in nodes.itervalues():
+            node.log.compact(start, end)
+        self.saved_nodes[end] = nodes.values()
+        if changes:
+            self.saved_lines[end] = changes
+
+    def forget_versions(self, version):
+        """Forget the history before `version`, which becomes the oldest
+        version undo can go back to."""
+        for v in xrange(self.first_version, version + 1):
+            for node in self.saved_nodes.pop(v, []):
+                node.log.forget(version)
+            self.saved_lines.pop(v, None)
+            if v < version:
+                self.forget_version(v)
+        for l in self.saved_parsers.get(version, []):
+            root = l[0].previous_version.parent
+            for node in [root, root.children[0], root.children[-1]]:
+                node.log.forget(version)
+        self.first_version = version
+        self.compacted = max(self.compacted, version)
+
+    def forget_version(self, version):
+        """Drop what was saved in `version` apart from the node records."""
+        for l in self.saved_parsers.pop(version, []):
+            l[0].forget_status(version)
+        self.cursor.log.pop(version, None)
+
+    def spill_versions(self):
+        """Move the records of versions that are older than the journal's
+        window out of memory."""
+        journal = self.undo_journal
+        while journal.spilled < self.version - journal.window:
+            version = journal.spilled + 1
+            nodes = list(self.saved_nodes.get(version, []))
+            for l in self.saved_parsers.get(version, []):
+                root = l[0].previous_version.parent
+                nodes.append(root)
+                nodes.append(root.children[0])
+                nodes.append(root.children[-1])
+            journal.spill(version, nodes)
 
     def key_home(self, shift=False):
         self.log_input("key_home", str(shift))
@@ -1396,6 +1585,7 @@ class TreeManager(object):
         node = self.cursor.node
         if text.startswith(node.symbol.name):
             node.symbol.name = text
+            node.invalidate_length()
             self.cursor.pos = len(text)
         else:
             self.pasteText(text)
@@ -1462,11 +1652,14 @@ class TreeManager(object):
             s = nodes[0].symbol.name
             s = s[:diff_start] + s[diff_end:]
             nodes[0].symbol.name = s
+            nodes[0].invalidate_length()
             self.delete_if_empty(nodes[0])
             self.clean_empty_lbox(nodes[0])
         else:
             nodes[0].symbol.name = nodes[0].symbol.name[:diff_start]
             nodes[-1].symbol.name = nodes[-1].symbol.name[diff_end:]
+            nodes[0].invalidate_length()
+            nodes[-1].invalidate_length()
             self.delete_if_empty(nodes[0])
             self.delete_if_empty(nodes[-1])
             self.clean_empty_lbox(nodes[0])
@@ -1580,13 +1773,17 @@ class TreeManager(object):
         text = text.replace("\n","\r")
         parser = self.parsers[0][0]
         lexer = self.parsers[0][1]
-        # lex text into tokens
+        # lex text into tokens and build the tree in one go
         bos = parser.previous_version.parent.children[0]
-        new = TextNode(Terminal(text))
-        bos.insert_after(new)
-        lexer.relex_import(new, self.version+1)
+        success = parser.bulk_load(lexer.lex(text), self.version+1)
+        if not success:
+            # add tokens unparsed and let the incremental parser deal with
+            # the syntax error
+            new = TextNode(Terminal(text))
+            bos.insert_after(new)
+            lexer.relex_import(new, self.version+1)
         self.rescan_linebreaks(0)
-        self.reparse(bos)
+        self.reparse(bos, changed=not success)
         self.undo_snapshot()
         self.changed = True
         return
@@ -1608,6 +1805,7 @@ class TreeManager(object):
         return self.export(path, source=source)
 
     def load_file(self, language_boxes, reparse=True):
+        self.activate()
         # setup language boxes
         TreeManager.version = 0
         for root, language, whitespaces in language_boxes:
@@ -1788,6 +1986,7 @@ class TreeManager(object):
             return text
 
     def relex(self, node):
+        self.activate()
         if node is None:
             return
         if isinstance(node, BOS) or isinstance(node, EOS):
@@ -1803,7 +2002,62 @@ class TreeManager(object):
         if self.last_saved_version < self.version:
             self.reparse(self.get_bos(), True)
 
+    def begin_transaction(self):
+        """
+        Start collecting edits. Until the matching commit_transaction, edits
+        are still relexed but neither parsed nor saved, so a batch of edits
+        only costs one incremental parse per changed language and one new
+        version. Transactions can be nested, only the outermost commit has
+        an effect.
+        """
+        self.transaction += 1
+
+    def commit_transaction(self):
+        self.transaction -= 1
+        if self.transaction > 0:
+            return
+        self.transaction = 0
+        self.flush_transaction()
+
+    def flush_transaction(self):
+        """Parse and save the edits collected so far."""
+        self.activate()
+        roots = [r for r in self.dirty_roots if self.get_parser(r) is not None]
+        self.dirty_roots = []
+        if not self.pending_save:
+            return
+        self.pending_save = False
+        transaction = self.transaction
+        self.transaction = 0
+        try:
+            # reparse language boxes before the boxes containing them
+            roots.sort(key=self.get_box_depth, reverse=True)
+            for root in roots[:-1]:
+                self.get_parser(root).inc_parse()
+            if roots:
+                self.reparse(roots[-1])
+            else:
+                self.reparse(self.get_bos(), False)
+        finally:
+            self.transaction = transaction
+
+    def get_box_depth(self, root):
+        depth = 0
+        lbox = root.get_magicterminal()
+        while lbox is not None:
+            depth += 1
+            lbox = lbox.get_root().get_magicterminal()
+        return depth
+
     def reparse(self, node, changed=True):
+        self.activate()
+        if self.transaction:
+            self.pending_save = True
+            if changed:
+                root = node.get_root()
+                if not [r for r in self.dirty_roots if r is root]:
+                    self.dirty_roots.append(root)
+            return
         if self.version < self.get_max_version():
             # we changed stuff after one or more undos
             # later versions are void -> delete
@@ -1817,28 +2071,48 @@ class TreeManager(object):
         TreeManager.version = self.version
 
     def undo_snapshot(self):
-        if self.undo_snapshots and self.undo_snapshots[-1] == self.version:
+        self.flush_transaction()
+        if self.undo_snapshots and self.undo_snapshots[-1] >= self.version:
             # Snapshot already taken (this can happen in fuzzy tests where
-            # undo_snapshot is called without any changes)
+            # undo_snapshot is called without any changes), or the version
+            # was reached by undo/redo, which only stop at snapshots and the
+            # first version. Snapshots stay sorted (see compact_history).
             return
         self.undo_snapshots.append(self.version)
 
     def save_current_version(self):
+        if self.transaction:
+            # saved by flush_transaction, which logs it then
+            self.pending_save = True
+            return
         self.log_input("save_current_version")
         self.version += 1
         self.save()
         TreeManager.version = self.version
 
     def full_reparse(self):
+        self.activate()
         for p in self.parsers:
             p[0].reparse()
 
-    def apply_inputlog(self, inputlog):
-        for l in inputlog.split("\n"):
-            l = l.replace("\r", "\\r")
-            if l.startswith("#"):
-                continue
-            try:
-                eval(l) # expressions
-            except SyntaxError:
-                exec(l) # statements
+    def apply_inputlog(self, inputlog, batched=False):
+        """
+        Replay the actions of `inputlog`. Each action is parsed as it is
+        applied, like it was when it was logged. With `batched`, the replay
+        runs in a transaction instead, so the document is only parsed and
+        saved once at the end.
+        """
+        if batched:
+            self.begin_transaction()
+        try:
+            for l in inputlog.split("\n"):
+                l = l.replace("\r", "\\r")
+                if l.startswith("#"):
+                    continue
+                try:
+                    eval(l) # expressions
+                except SyntaxError:
+                    exec(l) # statements
+        finally:
+            if batched:
+                self.commit_transaction()
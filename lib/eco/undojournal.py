@@ -0,0 +1,193 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import mmap, tempfile, zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from cStringIO import StringIO
+from collections import OrderedDict
+
+from incparser.astree import Node
+
+class Page(object):
+    """The records of one version that have been moved into the journal.
+
+    `refs` counts the histories that still hold the page instead of a record.
+    Once all of them have dropped it, the page is freed (see
+    UndoJournal.free)."""
+    __slots__ = ["journal", "offset", "length", "refs", "nodes"]
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.offset = 0
+        self.length = 0
+        self.refs = 0
+        self.nodes = () # ids of the nodes referenced by the records
+
+    def get(self, history):
+        return self.journal.load(self)[id(history)]
+
+    def release(self):
+        """Called by a History that drops its record of this page."""
+        self.refs -= 1
+        if self.refs == 0:
+            self.journal.free(self)
+
+class UndoJournal(object):
+    """
+    File holding the node records of old versions.
+
+    Only the records saved in the last `window` versions are kept in memory.
+    Older versions are pickled, compressed and appended to the journal, and
+    their records are replaced by a Page in the nodes' History. When undo
+    needs one of them again the page is read back from the memory mapped file,
+    the last `cache_size` pages that were read are kept around.
+
+    Nodes referenced by the records are written as ids and kept in `nodes`, so
+    loading a page returns the same node objects that are used in the tree.
+    `refs` counts the pages referencing each node, a node is dropped from
+    `nodes` when the last of them is freed. The space of freed pages is
+    reclaimed by compacting the file once it makes up half of it.
+    """
+
+    def __init__(self, path=None, window=100, cache_size=16):
+        if path is None:
+            self.file = tempfile.TemporaryFile()
+        else:
+            self.file = open(path, "w+b")
+        self.window = window
+        self.cache_size = cache_size
+        self.spilled = 0 # all versions up to here are in the journal
+        self.size = 0
+        self.garbage = 0 # bytes used by freed pages
+        self.pages = set()
+        self.map = None
+        self.nodes = {}
+        self.refs = {}
+        self.cache = OrderedDict()
+        self.dumped = None # nodes referenced by the page being written
+
+    def spill(self, version, nodes):
+        """Move the records `nodes` saved in `version` into the journal."""
+        page = Page(self)
+        records = {}
+        for node in nodes:
+            record = node.log.spill(version, page)
+            if record is not None:
+                records[id(node.log)] = record
+        self.spilled = version
+        if not records:
+            return
+
+        buf = StringIO()
+        pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = self.persistent_id
+        self.dumped = {}
+        pickler.dump(records)
+        data = zlib.compress(buf.getvalue())
+        for key, node in self.dumped.iteritems():
+            if key in self.refs:
+                self.refs[key] += 1
+            else:
+                self.nodes[key] = node
+                self.refs[key] = 1
+        page.nodes = tuple(self.dumped)
+        page.refs = len(records)
+        self.dumped = None
+
+        self.file.seek(self.size)
+        self.file.write(data)
+        page.offset = self.size
+        page.length = len(data)
+        self.size += len(data)
+        self.pages.add(page)
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Node):
+            self.dumped[id(obj)] = obj
+            return id(obj)
+        return None
+
+    def load(self, page):
+        try:
+            records = self.cache.pop(page)
+        except KeyError:
+            records = self.read(page)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[page] = records
+        return records
+
+    def read(self, page):
+        end = page.offset + page.length
+        if self.map is None or end > len(self.map):
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        data = zlib.decompress(self.map[page.offset:end])
+        unpickler = pickle.Unpickler(StringIO(data))
+        unpickler.persistent_load = self.nodes.__getitem__
+        return unpickler.load()
+
+    def free(self, page):
+        """Drop the nodes only `page` referenced. The page is no longer used
+        by any history."""
+        refs = self.refs
+        for key in page.nodes:
+            count = refs[key] - 1
+            if count:
+                refs[key] = count
+            else:
+                del refs[key]
+                del self.nodes[key]
+        page.nodes = ()
+        self.cache.pop(page, None)
+        self.pages.discard(page)
+        self.garbage += page.length
+        if self.garbage * 2 > self.size:
+            self.compact()
+
+    def compact(self):
+        """Move the pages that are still used to the start of the file and cut
+        off the rest."""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        pos = 0
+        for page in sorted(self.pages, key=lambda page: page.offset):
+            if page.offset != pos:
+                self.file.seek(page.offset)
+                data = self.file.read(page.length)
+                self.file.seek(pos)
+                self.file.write(data)
+                page.offset = pos
+            pos += page.length
+        self.file.flush()
+        self.file.truncate(pos)
+        self.size = pos
+        self.garbage = 0
+
+    def truncate(self, version):
+        """Forget that versions after `version` were spilled. Their pages are
+        removed from the nodes' histories by History.truncate, which frees
+        them."""
+        self.spilled = min(self.spilled, version)
@@ -130,7 +130,7 @@ class Viewer(object):
 
         children = node.children
         if node.symbol.name == "Root":
-            children = node.log[("children", version)]
+            children = node.get_attr("children", version)
         for c in children:
             key = ""
             if isinstance(node, AstNode):